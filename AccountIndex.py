@@ -0,0 +1,213 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import as_completed
+
+import pandas as pd
+
+from Metrics import metrics as default_metrics
+
+
+def normalize_name(name: str) -> str:
+    """Summoner names are unique regardless of case and spaces, e.g. "Double Lift" is "doublelift" """
+    return "".join(str(name).split()).lower()
+
+
+class AccountIndex:
+    """A persistent (region, summoner name) -> puuid index, so accounts are resolved once instead of on every run.
+
+    Names are stored normalized (see normalize_name) under the platform code of their region, so "NA" and "na1"
+    or "Faker" and "faker" are the same account. Every resolved summoner is also stored by puuid with its
+    current name: refresh() looks the puuids up again and records the names that changed. Old names keep
+    pointing to their puuid, so a roster that still lists an old name resolves without any request.
+    """
+
+    def __init__(self, analyzer, path: str = "accounts.sqlite", metrics=None):
+        self.analyzer = analyzer
+        self.path = path
+        self.metrics = metrics or default_metrics
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS accounts ("
+                "platform TEXT, name_key TEXT, name TEXT, puuid TEXT, resolved_at REAL, "
+                "PRIMARY KEY (platform, name_key))")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS summoners ("
+                "platform TEXT, puuid TEXT, name TEXT, checked_at REAL, PRIMARY KEY (platform, puuid))")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS renames ("
+                "platform TEXT, puuid TEXT, old_name TEXT, new_name TEXT, detected_at REAL)")
+
+    def platform(self, region: str) -> str:
+        """Turns a region name (NA) or platform code (na1) into the platform code"""
+        region = str(region).replace(":", "").strip()
+        if region.upper() in self.analyzer.regionDict:
+            return self.analyzer.regionDict[region.upper()]
+        if region.lower() in self.analyzer.regionDict.values():
+            return region.lower()
+        raise Exception(f"Region {region} not found")
+
+    def lookup(self, region: str, name: str, max_age: float = None):
+        """Returns the stored puuid of an account, None if it was never resolved or was resolved more than max_age seconds ago"""
+        with self.lock:
+            row = self.connection.execute("SELECT puuid, resolved_at FROM accounts WHERE platform = ? AND name_key = ?",
+                                          (self.platform(region), normalize_name(name))).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return row[0]
+
+    def __store(self, platform: str, summoner: dict, names: list = ()):
+        """Stores a summoner response under its current name and the given names, recording a rename if its name changed"""
+        now = time.time()
+        puuid, name = summoner["puuid"], summoner["name"]
+        renamed = None
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT name FROM summoners WHERE platform = ? AND puuid = ?",
+                                          (platform, puuid)).fetchone()
+            if row is not None and normalize_name(row[0]) != normalize_name(name):
+                renamed = row[0]
+                self.connection.execute("INSERT INTO renames VALUES (?, ?, ?, ?, ?)", (platform, puuid, row[0], name, now))
+            self.connection.execute("INSERT OR REPLACE INTO summoners VALUES (?, ?, ?, ?)", (platform, puuid, name, now))
+            for account_name in [name, *names]:
+                self.connection.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?)",
+                                        (platform, normalize_name(account_name), account_name, puuid, now))
+        if renamed is not None:
+            self.metrics.count("account_renames_total", region=platform)
+            self.metrics.event("account_renamed", "info", f"{renamed} is now {name}", region=platform,
+                               puuid=puuid, old_name=renamed, new_name=name)
+        return renamed
+
+    def resolve(self, region: str, name: str, max_age: float = None) -> str:
+        """Returns the puuid of an account, from the index if it is there, otherwise from the API"""
+        puuid = self.lookup(region, name, max_age)
+        self.metrics.count("account_lookups_total", result="hit" if puuid else "miss")
+        if puuid is not None:
+            return puuid
+        platform = self.platform(region)
+        summoner = self.analyzer.get_summoner(name, platform)
+        self.__store(platform, summoner, [name])
+        return summoner["puuid"]
+
+    def resolve_many(self, accounts: list, max_age: float = None) -> tuple:
+        """Resolves many (region, name) accounts at once. Accounts that are not in the index are looked up
+        concurrently, and accounts that are the same once normalized are only looked up once
+
+        Args:
+            accounts (list): A list of (region, name) tuples
+            max_age (float, optional): Looks up again the accounts resolved more than max_age seconds ago. Defaults to None.
+
+        Returns:
+            tuple: (puuids, errors). puuids maps every resolved (region, name) to its puuid,
+                errors maps the others to the error message
+        """
+        puuids, errors = {}, {}
+        # (platform, name_key) -> the accounts that are written that way
+        missing = {}
+        for region, name in dict.fromkeys(accounts):
+            try:
+                puuid = self.lookup(region, name, max_age)
+            except Exception as e:
+                errors[region, name] = str(e)
+                continue
+            if puuid is not None:
+                puuids[region, name] = puuid
+            else:
+                missing.setdefault((self.platform(region), normalize_name(name)), []).append((region, name))
+        self.metrics.count("account_lookups_total", len(puuids), result="hit")
+        self.metrics.count("account_lookups_total", len(missing), result="miss")
+
+        futures = {self.analyzer.engine.submit(self.analyzer.get_summoner, keys[0][1], platform): (platform, keys)
+                   for (platform, _), keys in missing.items()}
+        for future in as_completed(futures):
+            platform, keys = futures[future]
+            try:
+                summoner = future.result()
+            except Exception as e:
+                for key in keys:
+                    errors[key] = str(e)
+                continue
+            self.__store(platform, summoner, [name for _, name in keys])
+            for key in keys:
+                puuids[key] = summoner["puuid"]
+        return puuids, errors
+
+    def refresh(self, max_age: float = 0, platforms: list = None) -> pd.DataFrame:
+        """Looks up again, by puuid, the summoners checked more than max_age seconds ago, to find the ones that were renamed
+
+        Args:
+            max_age (float, optional): Only the summoners checked more than max_age seconds ago. Defaults to 0, all of them.
+            platforms (list, optional): Only the summoners of these platforms. Defaults to None, every platform.
+
+        Returns:
+            pd.DataFrame: The renames found, with the platform, puuid, old_name and new_name columns
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT platform, puuid FROM summoners WHERE checked_at <= ?",
+                                           (time.time() - max_age,)).fetchall()
+        if platforms is not None:
+            platforms = {self.platform(p) for p in platforms}
+            rows = [row for row in rows if row[0] in platforms]
+
+        # The response cache would hide the new names
+        futures = {self.analyzer.engine.submit(self.analyzer.get_summoner_by_puuid, puuid, platform, False): (platform, puuid)
+                   for platform, puuid in rows}
+        renames = []
+        for future in as_completed(futures):
+            platform, puuid = futures[future]
+            try:
+                summoner = future.result()
+            except Exception as e:
+                self.metrics.event("account_refresh_failed", "warning", f"Could not refresh {puuid}: {e}",
+                                   region=platform, puuid=puuid)
+                continue
+            old_name = self.__store(platform, summoner)
+            if old_name is not None:
+                renames.append({"platform": platform, "puuid": puuid, "old_name": old_name, "new_name": summoner["name"]})
+        return pd.DataFrame(renames, columns=["platform", "puuid", "old_name", "new_name"])
+
+    def renames(self) -> pd.DataFrame:
+        """Returns every rename detected so far"""
+        with self.lock:
+            return pd.read_sql_query("SELECT * FROM renames ORDER BY detected_at", self.connection)
+
+    def collapse(self, pro_accounts: list, max_age: float = None) -> tuple:
+        """Resolves the accounts of every pro and removes the ones that are the same account,
+        within a pro (e.g. an old and a new name both listed) and across pros
+
+        Args:
+            pro_accounts (list): One list of (region, name) tuples per pro, e.g. from account_keys
+            max_age (float, optional): Passed to resolve_many. Defaults to None.
+
+        Returns:
+            tuple: (unique, duplicates, errors). unique has one list of (region, name) tuples per pro, keeping
+                the first listing of every (platform, puuid). duplicates is a DataFrame of the listings that were dropped
+                with the pro, region, name, puuid, kept_pro and kept_name columns. errors maps the accounts that
+                could not be resolved to the error message, they are kept in unique
+        """
+        puuids, errors = self.resolve_many([key for keys in pro_accounts for key in keys], max_age)
+        first = {}
+        unique, duplicates = [], []
+        for pro, keys in enumerate(pro_accounts):
+            kept = []
+            for key in keys:
+                if key not in puuids:
+                    kept.append(key)
+                    continue
+                identity = (self.platform(key[0]), puuids[key])
+                if identity in first:
+                    kept_pro, kept_key = first[identity]
+                    duplicates.append({"pro": pro, "region": key[0], "name": key[1], "puuid": puuids[key],
+                                       "kept_pro": kept_pro, "kept_name": kept_key[1]})
+                    continue
+                first[identity] = (pro, key)
+                kept.append(key)
+            unique.append(kept)
+        duplicates = pd.DataFrame(duplicates, columns=["pro", "region", "name", "puuid", "kept_pro", "kept_name"])
+        return unique, duplicates, errors
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,205 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from Metrics import metrics as default_metrics
+
+
+# Diff row status codes
+status_codes = {"new": 0, "changed": 1, "removed": 2}
+
+state_columns = ["summonerId", "tier", "rank", "leaguePoints", "wins", "losses"]
+
+
+def leaderboard_frame(entries: list) -> pd.DataFrame:
+    """Builds the compact state of a leaderboard from league/v4/entries responses, one row per summonerId"""
+    df = pd.DataFrame(entries, columns=state_columns)
+    # A player can move between pages while they are being fetched, keep the first time they were seen
+    df = df.drop_duplicates("summonerId")
+    return df.astype({"tier": "category", "rank": "category", "leaguePoints": "int16",
+                      "wins": "int32", "losses": "int32"}).reset_index(drop=True)
+
+
+def leaderboard_diff(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """Compares two leaderboard states
+
+    Returns:
+        pd.DataFrame: One row per new, changed or removed summonerId, with its current tier and rank and the change
+            of leaguePoints, wins and losses. New players change from 0 and removed players change to 0,
+            so summing the diffs of a player gives their current values
+    """
+    merged = previous.merge(current, on="summonerId", how="outer", suffixes=("_old", "_new"), indicator=True)
+    removed = (merged["_merge"] == "left_only").to_numpy()
+    new = (merged["_merge"] == "right_only").to_numpy()
+
+    diff = pd.DataFrame({"summonerId": merged["summonerId"]})
+    for column in ["tier", "rank"]:
+        # Removed players keep their last tier and rank
+        diff[column] = merged[f"{column}_new"].astype(object).where(~removed, merged[f"{column}_old"].astype(object))
+    for column, dtype in [("leaguePoints", "int16"), ("wins", "int32"), ("losses", "int32")]:
+        old = merged[f"{column}_old"].fillna(0).to_numpy(np.int64)
+        new_values = merged[f"{column}_new"].fillna(0).to_numpy(np.int64)
+        diff[column] = (new_values - old).astype(dtype)
+    diff["status"] = np.where(removed, status_codes["removed"],
+                              np.where(new, status_codes["new"], status_codes["changed"])).astype("int8")
+
+    changed = removed | new | (diff[["leaguePoints", "wins", "losses"]].to_numpy() != 0).any(axis=1) \
+        | (merged["tier_old"].astype(object) != merged["tier_new"].astype(object)).to_numpy() \
+        | (merged["rank_old"].astype(object) != merged["rank_new"].astype(object)).to_numpy()
+    diff = diff[changed].reset_index(drop=True)
+    return diff.astype({"tier": "category", "rank": "category"})
+
+
+class LeaderboardSnapshots:
+    """Takes snapshots of the leaderboards of every region at once and stores them as diffs.
+
+    Every region and tier is paged on its own thread, the requests still go through the analyzer's RequestEngine
+    so every region keeps to its own rate limit. Each snapshot is stored as a Parquet file holding only the players
+    that changed since the previous snapshot of the region (see leaderboard_diff), under
+    root/diffs/region={platform}/taken_at={epoch seconds}/. The latest full state of every region is kept
+    in root/latest/{platform}.parquet to compute the next diff without replaying the history.
+    Requires pyarrow.
+    """
+
+    def __init__(self, analyzer, root: str = "leaderboards", queue: str = "solo", ranks: list = None,
+                 max_workers: int = 16, metrics=None):
+        """
+        Args:
+            analyzer (RiotAnalyzer): Sends the requests
+            root (str, optional): The folder of the snapshots. Defaults to "leaderboards".
+            queue (str, optional): The queue of the leaderboards, see RiotAnalyzer.queueDict. Defaults to "solo".
+            ranks (list, optional): The {tier}{division} ranks to capture. Defaults to every Diamond division.
+            max_workers (int, optional): How many region and rank leaderboards are paged at once. Defaults to 16.
+        """
+        self.analyzer = analyzer
+        self.root = root
+        self.queue = queue
+        self.ranks = ranks or ["d1", "d2", "d3", "d4"]
+        self.max_workers = max_workers
+        self.metrics = metrics or default_metrics
+
+    @property
+    def platforms(self) -> list:
+        return list(dict.fromkeys(self.analyzer.regionDict.values()))
+
+    def latest_path(self, platform: str) -> str:
+        return os.path.join(self.root, "latest", f"{platform}.parquet")
+
+    def diff_path(self, platform: str, taken_at: int) -> str:
+        return os.path.join(self.root, "diffs", f"region={platform}", f"taken_at={taken_at}", "diff.parquet")
+
+    def fetch(self, platform: str, rank: str) -> list:
+        """Gets every page of the leaderboard of a rank in a region"""
+        entries = []
+        page = 1
+        while True:
+            data = self.analyzer.get_leaderboard_raw(self.queue, rank, platform, page)
+            if not data:
+                break
+            entries.extend(data)
+            page += 1
+        return entries
+
+    def take(self, platforms: list = None) -> dict:
+        """Takes a snapshot of every region concurrently and stores the diff of each one against its previous snapshot
+
+        Args:
+            platforms (list, optional): The platforms to capture, e.g. ["na1", "kr"]. Defaults to every platform of regionDict.
+
+        Returns:
+            dict: {platform: {"entries", "new", "changed", "removed"}} for the stored regions, and "errors"
+                mapping each platform that failed to the error message. A region is only stored if all of its ranks were fetched
+        """
+        platforms = platforms or self.platforms
+        taken_at = int(time.time())
+        entries = {}
+        errors = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, platform, rank): (platform, rank)
+                       for platform in platforms for rank in self.ranks}
+            for future in as_completed(futures):
+                platform, rank = futures[future]
+                try:
+                    entries[platform, rank] = future.result()
+                except Exception as e:
+                    errors[platform] = str(e)
+
+        summary = {}
+        for platform in platforms:
+            if platform in errors:
+                continue
+            # Ranks are combined in the order they were asked for, whatever order they arrived in
+            state = leaderboard_frame([entry for rank in self.ranks for entry in entries[platform, rank]])
+            summary[platform] = self.store(platform, state, taken_at)
+        self.metrics.observe("leaderboard_snapshot_seconds", time.perf_counter() - start)
+        self.metrics.event("leaderboard_snapshot", "info",
+                           f"Snapshot of {len(summary)} regions, {sum(s['entries'] for s in summary.values())} entries",
+                           taken_at=taken_at, regions=len(summary), errors=len(errors))
+        summary["errors"] = errors
+        return summary
+
+    def store(self, platform: str, state: pd.DataFrame, taken_at: int) -> dict:
+        """Stores the diff of a region's state against its latest state, and makes it the latest state"""
+        previous = self.load_latest(platform)
+        if previous is None:
+            previous = leaderboard_frame([])
+        diff = leaderboard_diff(previous, state)
+
+        path = self.diff_path(platform, taken_at)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        diff.to_parquet(path, index=False)
+        latest = self.latest_path(platform)
+        os.makedirs(os.path.dirname(latest), exist_ok=True)
+        # Written next to the old file and swapped in, so a crash never leaves a half written state
+        state.to_parquet(latest + ".tmp", index=False)
+        os.replace(latest + ".tmp", latest)
+
+        self.metrics.count("leaderboard_diff_rows_total", len(diff), region=platform)
+        counts = np.bincount(diff["status"].to_numpy(), minlength=len(status_codes))
+        return {"entries": len(state), **{status: int(counts[code]) for status, code in status_codes.items()}}
+
+    def load_latest(self, platform: str):
+        """Loads the latest state of a region, None if it was never captured"""
+        path = self.latest_path(platform)
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path)
+
+    def load_diffs(self, platforms: list = None, since: int = None, until: int = None) -> pd.DataFrame:
+        """Loads the stored diffs, with their region and taken_at columns
+
+        Args:
+            platforms (list, optional): Only the diffs of these platforms. Defaults to None, every platform.
+            since (int, optional): Only the snapshots taken after this epoch timestamp, in seconds. Defaults to None.
+            until (int, optional): Only the snapshots taken at or before this epoch timestamp. Defaults to None.
+        """
+        filters = []
+        if platforms is not None:
+            filters.append(("region", "in", list(platforms)))
+        if since is not None:
+            filters.append(("taken_at", ">", since))
+        if until is not None:
+            filters.append(("taken_at", "<=", until))
+        df = pd.read_parquet(os.path.join(self.root, "diffs"), filters=filters or None)
+        df["region"] = df["region"].astype(str).astype("category")
+        df["taken_at"] = df["taken_at"].astype("int64")
+        return df.sort_values("taken_at", kind="stable").reset_index(drop=True)
+
+    def load_state(self, platform: str, at: int = None) -> pd.DataFrame:
+        """Rebuilds the state of a region at a point in time by summing its diffs
+
+        Args:
+            platform (str): The platform, e.g. na1
+            at (int, optional): Epoch timestamp in seconds. Defaults to None, the latest snapshot.
+        """
+        diffs = self.load_diffs([platform], until=at)
+        values = diffs.groupby("summonerId", sort=False)[["leaguePoints", "wins", "losses"]].sum()
+        last = diffs.groupby("summonerId", sort=False)[["tier", "rank", "status"]].last()
+        state = last.join(values)
+        state = state[state["status"] != status_codes["removed"]].drop(columns="status").reset_index()
+        return state[state_columns].astype({"tier": "category", "rank": "category", "leaguePoints": "int16",
+                                            "wins": "int32", "losses": "int32"})
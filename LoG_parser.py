@@ -1,34 +1,153 @@
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import requests
 from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+from Metrics import metrics
 
 # Initialize the Chrome driver
 chrome_options = Options()
 chrome_options.add_argument("--incognito")
 chrome_options.add_argument("--headless")
 
-def scrape_log(champ_name:str):
+url_template = 'https://www.leagueofgraphs.com/champions/stats/{champ_name}'
+
+http_header = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# League of Graphs role filters -> role columns of Champs_w_roles.xlsx
+role_names = {"top": "Top", "jungle": "Jungle", "mid": "Mid", "middle": "Mid",
+              "adc": "Bot", "bottom": "Bot", "support": "Sup"}
+role_columns = ["Top", "Jungle", "Mid", "Bot", "Sup"]
+
+# Champions whose League of Graphs page doesn't follow the name with the punctuation removed
+slug_exceptions = {"nunuwillump": "nunu", "renataglasc": "renata"}
+
+
+def champ_slug(champ_name: str) -> str:
+    """Turns a champion name into its League of Graphs URL name, e.g. Kai'Sa -> kaisa"""
+    slug = re.sub(r"[^a-z0-9]", "", champ_name.lower())
+    return slug_exceptions.get(slug, slug)
+
+
+class DriverPool:
+    """A small pool of long-lived headless Chrome drivers, so the browser start up cost is paid once per driver
+    instead of once per champion. Drivers are started lazily, up to size of them.
+    A driver that raises a WebDriverException (e.g. its browser crashed) is quit and replaced by a new one.
+    """
+
+    def __init__(self, size: int = 4, options: Options = chrome_options):
+        self.size = size
+        self.options = options
+        self.idle = queue.Queue()
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def __borrow(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    if len(self.drivers) < self.size:
+                        driver = webdriver.Chrome(options=self.options)
+                        self.drivers.append(driver)
+                        return driver
+                driver = self.idle.get()
+            # None means a driver was removed, its place can be taken by a new one
+            if driver is not None:
+                return driver
+
+    @contextmanager
+    def driver(self):
+        """Borrows a driver from the pool, starting a new one if none is idle and the pool isn't full"""
+        driver = self.__borrow()
+        crashed = False
+        try:
+            yield driver
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            if crashed:
+                # The session is probably dead, don't hand it to the next champion
+                with self.lock:
+                    self.drivers.remove(driver)
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+                metrics.count("log_driver_restarts_total")
+                self.idle.put(None)
+            else:
+                self.idle.put(driver)
+
+    def close(self):
+        for driver in self.drivers:
+            driver.quit()
+        self.drivers = []
+        self.idle = queue.Queue()
+
+
+def scrape_log(champ_name:str, driver=None):
+    """Gets the inner HTML of the roles table of the champion's League of Graphs page with a headless Chrome.
+    If no driver is given, a new one is started and closed for this champion only.
+    """
     champ_name = champ_name.lower()
-    url = f'https://www.leagueofgraphs.com/champions/stats/{champ_name}'
-    
-    driver = webdriver.Chrome(options=chrome_options)
+    url = url_template.format(champ_name=champ_name)
+
+    own_driver = driver is None
+    if own_driver:
+        driver = webdriver.Chrome(options=chrome_options)
     driver.get(url)
     html = None
     try:
         # Search for <table class="data_table sortable_table">
-        table = driver.find_element(By.CLASS_NAME, "data_table")  
+        table = driver.find_element(By.CLASS_NAME, "data_table")
     except NoSuchElementException:
-        print("Champion name incorrect")
+        metrics.event("log_table_not_found", "warning", "Champion name incorrect", champ_name=champ_name)
     else:
         # Get the table's inner HTML
-        html = table.get_attribute("innerHTML")  
+        html = table.get_attribute("innerHTML")
     finally:
-        driver.close()
-    
+        if own_driver:
+            driver.close()
+
     return html
 
+def scrape_log_http(champ_name:str, session:requests.Session=None):
+    """Gets the inner HTML of the roles table with a plain HTTP request, without starting a browser.
+    Returns None if the table isn't in the static HTML of the page.
+    """
+    session = session or requests
+    url = url_template.format(champ_name=champ_name.lower())
+    start = time.perf_counter()
+    response = session.get(url, headers=http_header, timeout=30)
+    metrics.observe("log_request_seconds", time.perf_counter() - start, method="http")
+    metrics.count("log_requests_total", method="http", status=response.status_code)
+    if response.status_code != 200:
+        return None
+    # Only the data tables are parsed
+    with metrics.timer("log_parse_seconds", step="page"):
+        soup = BeautifulSoup(response.text, "html.parser", parse_only=SoupStrainer("table", class_="data_table"))
+    table = soup.find("table", class_="data_table")
+    if table is None:
+        return None
+    return table.decode_contents()
+
 def parse_log(html:str):
     # Parse the html
     soup = BeautifulSoup(html, "html.parser")
@@ -49,7 +168,141 @@ def parse_log(html:str):
     role_winrates = dict(zip(top_roles, role_winrates))
     return role_winrates
 
+def parse_log_rows(html:str):
+    """Parses the play rate and win rate of every role from the roles table
+
+    Returns:
+        dict: {role: {"playrate": float, "winrate": float}}, in percent. The win rate is the wgblue progress bar
+            of the row, like in parse_log, and the play rate is the other progress bar of the row
+    """
+    with metrics.timer("log_parse_seconds", step="table"):
+        soup = BeautifulSoup(html, "html.parser")
+    roles = {}
+    for row in soup.find_all("tr"):
+        link = row.find("a", attrs={"filter-role": True})
+        if link is None:
+            continue
+        rates = {"playrate": None, "winrate": None}
+        for progressbar in row.find_all("progressbar"):
+            value = float(f"{100*float(progressbar['data-value']):.2f}")
+            if progressbar.get("data-color") == "wgblue":
+                rates["winrate"] = value
+            elif rates["playrate"] is None:
+                rates["playrate"] = value
+        roles[link["filter-role"]] = rates
+    return roles
+
 def get_champ_roles(champ_name:str):
     html = scrape_log(champ_name)
     role_winrates = parse_log(html)
-    return role_winrates
\ No newline at end of file
+    return role_winrates
+
+def cache_path(cache_dir:str, patch:str, champ_name:str):
+    return os.path.join(cache_dir, patch, f"{champ_slug(champ_name)}.html")
+
+def get_log_table(champ_name:str, patch:str, cache_dir:str="log_cache", pool:DriverPool=None,
+                  session:requests.Session=None, use_http:bool=True, refresh:bool=False):
+    """Gets the roles table HTML of a champion, from the cache if it was already scraped for this patch.
+    Tries a plain HTTP request first, and falls back to a browser from the pool if the table is rendered by JavaScript.
+    """
+    path = cache_path(cache_dir, patch, champ_name)
+    if not refresh and os.path.exists(path):
+        metrics.count("log_cache_lookups_total", result="hit")
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    metrics.count("log_cache_lookups_total", result="miss")
+
+    slug = champ_slug(champ_name)
+    html = None
+    if use_http:
+        try:
+            html = scrape_log_http(slug, session)
+        except requests.RequestException:
+            html = None
+    if html is None:
+        start = time.perf_counter()
+        if pool is None:
+            html = scrape_log(slug)
+        else:
+            with pool.driver() as driver:
+                html = scrape_log(slug, driver)
+        metrics.observe("log_request_seconds", time.perf_counter() - start, method="browser")
+    if html is None:
+        raise Exception(f"Roles table of {champ_name} not found")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return html
+
+def get_champ_roles_many(champ_names:list, patch:str, workers:int=4, cache_dir:str="log_cache",
+                         use_http:bool=True, refresh:bool=False):
+    """Scrapes the roles table of many champions in parallel, reusing a pool of browsers and caching the raw
+    table HTML per champion and patch, so the tables can be parsed again offline
+
+    Args:
+        champ_names (list): The champion names, e.g. the names of RiotAnalyzer.get_champion_dict()
+        patch (str): The patch the tables belong to, used as the cache folder
+        workers (int, optional): How many champions are scraped at once (and the size of the browser pool). Defaults to 4.
+        cache_dir (str, optional): The folder of the cache. Defaults to "log_cache".
+        use_http (bool, optional): Tries a plain HTTP request before starting a browser. Defaults to True.
+        refresh (bool, optional): Scrapes the champions again even if they are cached. Defaults to False.
+
+    Returns:
+        tuple: (roles, errors). roles is a list of {"name", "role", "playrate", "winrate"} dictionaries,
+            one per champion and role, and errors maps the champions that failed to the error message
+    """
+    pool = DriverPool(workers)
+    session = requests.Session()
+    rows, errors = [], {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(get_log_table, name, patch, cache_dir, pool, session, use_http, refresh): name
+                       for name in champ_names}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    roles = parse_log_rows(future.result())
+                except Exception as e:
+                    errors[name] = str(e)
+                    continue
+                for role, rates in roles.items():
+                    rows.append({"name": name, "role": role_names.get(role, role.title()), **rates})
+    finally:
+        pool.close()
+    return rows, errors
+
+def build_role_table(rows:list, champion_dict:dict, threshold:float=15):
+    """Builds the role table of Champs_w_roles.xlsx: a champion has a role if its play rate in that role
+    is at least threshold percent of its total play rate. The table can be passed to MasteryMatrix.load_role_matrix
+
+    Args:
+        rows (list): The roles from get_champ_roles_many
+        champion_dict (dict): The champion map from RiotAnalyzer.get_champion_dict, whose names were scraped
+        threshold (float, optional): The minimum share of the champion's play rate, in percent. Defaults to 15.
+
+    Returns:
+        pd.DataFrame: One row per champion with a key and a name column, a Top, Jungle, Mid, Bot and Sup column
+            that is True if the champion plays the role and NaN otherwise, and the "{role} playrate" and
+            "{role} winrate" columns of every role, in percent
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(rows, columns=["name", "role", "playrate", "winrate"])
+    total = df.groupby("name")["playrate"].transform("sum")
+    df["share"] = 100 * df["playrate"] / total
+    names = sorted(df["name"].unique())
+    table = df[df["share"] >= threshold].pivot_table(index="name", columns="role", values="share", aggfunc="first")
+    table = table.reindex(index=names, columns=role_columns)
+    table = table.notna().where(table.notna())
+    rates = df.pivot_table(index="name", columns="role", values=["playrate", "winrate"], aggfunc="first")
+    for role in role_columns:
+        for rate in ["playrate", "winrate"]:
+            table[f"{role} {rate}"] = rates[rate][role].reindex(names) if role in rates[rate].columns else float("nan")
+
+    keys = {name: int(key) for key, name in champion_dict.items()}
+    table.index.name = "name"
+    table.columns.name = None
+    table = table.reset_index()
+    table.insert(0, "key", table["name"].map(keys).astype("Int64"))
+    return table
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from MasteryMatrix import MasteryMatrix, role_list
+from MasteryPipeline import unique_records
+
+
+class MasteryExporter:
+    """Streams the pipeline's results to partitioned CSV and Parquet files for Power BI, a pro at a time,
+    so the full long table never has to be held in memory and the dashboard can load the parts already written.
+
+    Three tables are written under root/{format} as numbered part files:
+        mastery/region={region}/part-N: one row per pro, account and champion, about chunk_rows rows per part
+        scores/part-N: one row per pro with the mainrolescore, offrolescore, onetrickscore and totalmastery,
+            chunk_pros pros per part
+        donut/part-N: one row per pro and slice of its donut chart, its top_champions champions and "Other",
+            chunk_pros pros per part
+
+    An account listed under several pros is only counted for the first pro it is exported with, so the pros must be
+    added in roster order for the scores to match MasteryMatrix.from_results (MasteryPipeline.run does).
+
+    Part files are written under a temporary name and renamed once complete, and a _SUCCESS file is written
+    by close(), so readers never see half written files.
+    Parquet requires pyarrow.
+    """
+
+    def __init__(self, root: str = "export", champion_dict: dict = None, role_matrix: np.ndarray = None,
+                 champion_ids: list = None, chunk_rows: int = 100000, chunk_pros: int = 100,
+                 formats: tuple = ("csv", "parquet"), top_champions: int = 10):
+        """
+        Args:
+            root (str, optional): The folder of the export. Defaults to "export".
+            champion_dict (dict, optional): The champion map from RiotAnalyzer.get_champion_dict, for the champion names
+                and the champion count of the onetrick score. Defaults to None.
+            role_matrix (np.ndarray, optional): The champion x role matrix from load_role_matrix, in the order of
+                champion_ids. Without it the role scores are NaN. Defaults to None.
+            champion_ids (list, optional): The champion ids of the rows of role_matrix. Defaults to the sorted keys of
+                champion_dict, like MasteryMatrix.from_results.
+            chunk_rows (int, optional): The maximum number of mastery rows kept in memory and written per part file.
+                Defaults to 100000.
+            chunk_pros (int, optional): The number of pros whose scores and donut rows are written per part file,
+                so they can be loaded long before the end of the run. Defaults to 100.
+            formats (tuple, optional): The file formats to write. Defaults to ("csv", "parquet").
+            top_champions (int, optional): The number of champions of each donut chart. Defaults to 10.
+        """
+        self.root = root
+        self.champion_dict = champion_dict or {}
+        self.champion_ids = champion_ids or sorted(int(key) for key in self.champion_dict)
+        self.role_matrix = role_matrix
+        self.chunk_rows = chunk_rows
+        self.chunk_pros = chunk_pros
+        self.formats = formats
+        self.top_champions = top_champions
+        self.parts = {"mastery": 0, "scores": 0, "donut": 0}
+        self.buffers = {"mastery": [], "scores": [], "donut": []}
+        self.buffered_rows = {"mastery": 0, "scores": 0, "donut": 0}
+        # The (platform, puuid) of every account already exported with a pro
+        self.counted = set()
+        os.makedirs(root, exist_ok=True)
+
+    def add_pro(self, pro, pro_row: pd.Series, accounts: list, results: dict):
+        """Exports the mastery, scores and donut rows of one pro whose accounts are all fetched
+
+        Args:
+            pro: The index label of the pro in the pro dataframe
+            pro_row (pd.Series): The pro's row of the pro dataframe
+            accounts (list): The pro's (region, name) accounts, e.g. account_keys of its Account_list
+            results (dict): The (region, name) -> checkpoint record results, with at least the pro's accounts
+        """
+        # An account listed several times, under this pro or an earlier one, is only counted once,
+        # like MasteryMatrix.from_results
+        records = unique_records(accounts, results, self.counted)
+
+        lengths = [len(record["mastery"]) for record in records]
+        mastery = [m for record in records for m in record["mastery"]]
+        champion_ids = np.fromiter((m["championId"] for m in mastery), dtype=np.int16, count=len(mastery))
+        points = np.fromiter((m["championPoints"] for m in mastery), dtype=np.int64, count=len(mastery))
+        total = points.sum()
+        share = points / total if total > 0 else np.zeros(len(points))
+
+        name = pro_row.get("Official Summoner Name")
+        self.__add("mastery", self.chunk_rows, pd.DataFrame({
+            "pro_id": pro,
+            "pro": name,
+            "team": pro_row.get("Team"),
+            "region": np.repeat([record["region"] for record in records], lengths),
+            "summoner_name": np.repeat([record["name"] for record in records], lengths),
+            "puuid": np.repeat([record["puuid"] for record in records], lengths),
+            "championId": champion_ids,
+            "championName": [self.champion_dict.get(str(c)) for c in champion_ids.tolist()],
+            "championPoints": points.astype(np.int32),
+            "championLevel": np.fromiter((m["championLevel"] for m in mastery), dtype=np.int8, count=len(mastery)),
+            "lastPlayTime": pd.to_datetime(np.fromiter((m["lastPlayTime"] for m in mastery), dtype=np.int64,
+                                                       count=len(mastery)), unit="ms"),
+            "share": share,
+        }))
+
+        # The pro's champion pool, summed over its accounts
+        pool = pd.Series(points).groupby(champion_ids).sum()
+        self.__add("scores", None, self.__scores(pro, pro_row, pool))
+        self.__add("donut", None, self.__donut(pro, name, pool))
+        # One scores row per pro
+        if self.buffered_rows["scores"] >= self.chunk_pros:
+            self.flush("scores")
+            self.flush("donut")
+
+    def __scores(self, pro, pro_row: pd.Series, pool: pd.Series) -> pd.DataFrame:
+        champion_ids = list(self.champion_ids)
+        columns = {c: i for i, c in enumerate(champion_ids)}
+        row = np.zeros(len(champion_ids) + sum(int(c) not in columns for c in pool.index))
+        for champion_id, value in pool.items():
+            if int(champion_id) not in columns:
+                columns[int(champion_id)] = len(champion_ids)
+                champion_ids.append(int(champion_id))
+            row[columns[int(champion_id)]] = value
+        matrix = MasteryMatrix(pd.Index([pro]), champion_ids, row[None, :], len(self.champion_dict) or None)
+        if self.role_matrix is not None:
+            role_matrix = np.zeros((len(champion_ids), len(role_list)), dtype=bool)
+            role_matrix[:len(self.role_matrix)] = self.role_matrix
+            scores = matrix.scores([pro_row.get("Roles (LeaguePedia)")], role_matrix)
+        else:
+            total = matrix.total_mastery()
+            scores = pd.DataFrame({"mainrolescore": np.nan, "offrolescore": np.nan,
+                                   "onetrickscore": np.where(total > 0, matrix.onetrick_scores(), np.nan),
+                                   "totalmastery": total}, index=matrix.pros)
+        scores.index.name = "pro_id"
+        scores = scores.reset_index()
+        scores.insert(1, "pro", pro_row.get("Official Summoner Name"))
+        scores.insert(2, "team", pro_row.get("Team"))
+        scores.insert(3, "region", pro_row.get("Region"))
+        scores.insert(4, "role", pro_row.get("Roles (LeaguePedia)"))
+        return scores
+
+    def __donut(self, pro, name, pool: pd.Series) -> pd.DataFrame:
+        pool = pool.sort_values(ascending=False, kind="stable")
+        total = pool.sum()
+        top = pool.iloc[:self.top_champions]
+        champions = [self.champion_dict.get(str(c), str(c)) for c in top.index]
+        points = list(top.to_numpy())
+        if len(pool) > self.top_champions:
+            champions.append("Other")
+            points.append(pool.iloc[self.top_champions:].sum())
+        points = np.array(points, dtype=np.int64)
+        return pd.DataFrame({
+            "pro_id": pro,
+            "pro": name,
+            "slice": np.arange(1, len(points) + 1, dtype=np.int8),
+            "champion": champions,
+            "championPoints": points,
+            "share": points / total if total > 0 else np.zeros(len(points)),
+        })
+
+    def __add(self, table: str, chunk_rows: int, df: pd.DataFrame):
+        self.buffers[table].append(df)
+        self.buffered_rows[table] += len(df)
+        if chunk_rows is not None and self.buffered_rows[table] >= chunk_rows:
+            self.flush(table)
+
+    def flush(self, table: str = None):
+        """Writes the buffered rows of a table, or of every table, as new part files"""
+        for name in [table] if table else list(self.buffers):
+            if not self.buffers[name]:
+                continue
+            df = pd.concat(self.buffers[name], ignore_index=True)
+            self.buffers[name] = []
+            self.buffered_rows[name] = 0
+            self.parts[name] += 1
+            if name == "mastery":
+                df["region"] = df["region"].astype("category")
+                for region, part in df.groupby("region", observed=True, sort=False):
+                    self.__write(part.drop(columns="region"), os.path.join(name, f"region={region}"), self.parts[name])
+            else:
+                self.__write(df, name, self.parts[name])
+
+    def __write(self, df: pd.DataFrame, folder: str, part: int):
+        for file_format in self.formats:
+            path = os.path.join(self.root, file_format, folder, f"part-{part:05d}.{file_format}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if file_format == "csv":
+                df.to_csv(path + ".tmp", index=False)
+            elif file_format == "parquet":
+                df.to_parquet(path + ".tmp", index=False)
+            else:
+                raise Exception(f"Format {file_format} not supported")
+            os.replace(path + ".tmp", path)
+
+    def close(self):
+        """Writes the remaining rows and marks the export as complete"""
+        self.flush()
+        with open(os.path.join(self.root, "_SUCCESS"), "w"):
+            pass
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+from MasteryPipeline import account_keys, roster_account_lists, unique_records
+
+
+role_list = ['Top', 'Jungle', 'Mid', 'Bot', 'Sup']
+
+
+def load_role_matrix(champion_ids: list, path: str = "Champs_w_roles.xlsx", role_df: pd.DataFrame = None) -> np.ndarray:
+    """Builds the champion x role membership matrix from the role table.
+    A champion plays a role if its cell in that role's column is not empty.
+
+    Args:
+        champion_ids (list): The champion ids of the rows of the matrix, as ints
+        path (str, optional): The path of the role table. Defaults to "Champs_w_roles.xlsx".
+        role_df (pd.DataFrame, optional): The role table itself, if it is already loaded. Defaults to None.
+
+    Returns:
+        np.ndarray: A boolean matrix of shape (len(champion_ids), len(role_list)). Champions missing from
+            the role table have no roles
+    """
+    if role_df is None:
+        role_df = pd.read_excel(path)
+    rows = {int(key): i for i, key in enumerate(role_df["key"])}
+    membership = role_df[role_list].notna().to_numpy()
+    role_matrix = np.zeros((len(champion_ids), len(role_list)), dtype=bool)
+    for i, champion_id in enumerate(champion_ids):
+        if champion_id in rows:
+            role_matrix[i] = membership[rows[champion_id]]
+    return role_matrix
+
+
+class MasteryMatrix:
+    """A dense pros x champions matrix of mastery points, summed across every account of each pro.
+    All the per-pro scores are computed from it with a few NumPy operations, without any API call.
+    """
+
+    def __init__(self, pros: pd.Index, champion_ids: list, points: np.ndarray, champion_count: int = None):
+        """
+        Args:
+            pros (pd.Index): The index of the pro dataframe, one entry per row of points
+            champion_ids (list): The champion id of each column of points, as ints
+            points (np.ndarray): The mastery points matrix, of shape (len(pros), len(champion_ids))
+            champion_count (int, optional): The number of champions in the game, used by the onetrick score.
+                Defaults to len(champion_ids).
+        """
+        self.pros = pd.Index(pros)
+        self.champion_ids = [int(c) for c in champion_ids]
+        self.columns = {c: i for i, c in enumerate(self.champion_ids)}
+        self.points = np.asarray(points, dtype=np.float64)
+        self.champion_count = champion_count or len(self.champion_ids)
+
+    @classmethod
+    def from_results(cls, roster_df: pd.DataFrame, results: dict, champion_dict: dict):
+        """Builds the matrix from the results of MasteryPipeline.run
+
+        Args:
+            roster_df (pd.DataFrame): The pro dataframe the pipeline was run on
+            results (dict): The (region, name) -> checkpoint record results of the pipeline
+            champion_dict (dict): The champion map of the current version, from RiotAnalyzer.get_champion_dict.
+                Its size is the champion count used by the onetrick score
+
+        Returns:
+            MasteryMatrix: The pros x champions matrix
+        """
+        account_lists = roster_account_lists(roster_df)
+
+        champion_ids = sorted(int(key) for key in champion_dict)
+        columns = {c: i for i, c in enumerate(champion_ids)}
+        rows, cols, values = [], [], []
+        # An account listed several times (another name, region alias or pro) is only counted the first time
+        counted = set()
+        for row, account_list in enumerate(account_lists):
+            for record in unique_records(account_keys(account_list), results, counted):
+                for m in record["mastery"]:
+                    champion_id = int(m["championId"])
+                    # Champions newer than the champion map still count towards the total
+                    if champion_id not in columns:
+                        columns[champion_id] = len(champion_ids)
+                        champion_ids.append(champion_id)
+                    rows.append(row)
+                    cols.append(columns[champion_id])
+                    values.append(m["championPoints"])
+
+        points = np.zeros((len(account_lists), len(champion_ids)), dtype=np.float64)
+        # Alt accounts of the same pro land on the same row and are summed
+        np.add.at(points, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), values)
+        return cls(roster_df.index, champion_ids, points, champion_count=len(champion_dict))
+
+    def total_mastery(self) -> np.ndarray:
+        return self.points.sum(axis=1)
+
+    def shares(self) -> np.ndarray:
+        """Returns the share of each champion in each pro's total mastery, NaN for pros without mastery"""
+        total = self.total_mastery()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.points / total[:, None]
+
+    def role_shares(self, role_matrix: np.ndarray) -> pd.DataFrame:
+        """Returns the share of each pro's mastery spent on champions of each role.
+        A champion with several roles counts towards all of them, so the shares can add up to more than 1.
+
+        Args:
+            role_matrix (np.ndarray): The champion x role membership matrix from load_role_matrix
+
+        Returns:
+            pd.DataFrame: A pros x roles dataframe
+        """
+        role_points = self.points @ role_matrix.astype(np.float64)
+        total = self.total_mastery()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame(role_points / total[:, None], index=self.pros, columns=role_list)
+
+    def onetrick_scores(self) -> np.ndarray:
+        """Onetrick score: the sum of squared differences between the percentage of mastery on each champion
+        and the percentage if every champion of the game was played equally.
+        Like the original per-pro loop, only the champions the pro has mastery on are summed.
+        """
+        percent = 100 * self.shares()
+        diff = np.where(self.points > 0, (percent - 100 / self.champion_count) ** 2, 0)
+        return diff.sum(axis=1)
+
+    def scores(self, main_roles, role_matrix: np.ndarray) -> pd.DataFrame:
+        """Computes the mainrolescore, offrolescore, onetrickscore and totalmastery of every pro at once
+
+        Args:
+            main_roles (list-like): The main role of each pro, e.g. the Roles (LeaguePedia) column
+            role_matrix (np.ndarray): The champion x role membership matrix from load_role_matrix
+
+        Returns:
+            pd.DataFrame: A dataframe indexed like the pro dataframe. Pros without mastery get NaN scores,
+                and pros whose main role is not one of role_list get a NaN mainrolescore and offrolescore
+        """
+        role_share = self.role_shares(role_matrix).to_numpy()
+        role_idx = np.array([role_list.index(r) if r in role_list else -1 for r in main_roles], dtype=np.intp)
+        mainrolescore = np.where(role_idx >= 0, role_share[np.arange(len(role_idx)), role_idx], np.nan)
+        total = self.total_mastery()
+        has_mastery = total > 0
+        return pd.DataFrame({
+            "mainrolescore": mainrolescore,
+            "offrolescore": 1 - mainrolescore,
+            "onetrickscore": np.where(has_mastery, self.onetrick_scores(), np.nan),
+            "totalmastery": total,
+        }, index=self.pros)
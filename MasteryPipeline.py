@@ -0,0 +1,332 @@
+import ast
+import json
+import os
+import threading
+import time
+from concurrent.futures import as_completed
+
+import pandas as pd
+
+from RiotAnalyzer import RiotAnalyzer
+
+
+# Only these fields of a mastery response are kept in the checkpoint
+mastery_fields = ["championId", "championLevel", "championPoints", "lastPlayTime"]
+
+
+def build_account_list(df: pd.DataFrame) -> list:
+    """Builds the Account_list column of the pro dataframe: the soloq ids of every pro, with their
+    official summoner name added to their home region
+
+    Args:
+        df (pd.DataFrame): The pro dataframe, with the Region, Official Summoner Name and ids columns
+
+    Returns:
+        list: A list of dictionaries in the form {"NA:": ["name 1", "name 2"], "KR:": ["name 3"]}, one per row
+    """
+    all_accounts = []
+    for region, main_name, ids in zip(df["Region"], df["Official Summoner Name"], df["ids"]):
+        home_region = str(region) + ":"
+        accounts = ast.literal_eval(ids) if isinstance(ids, str) else dict(ids)
+        accounts = {k: list(v) if isinstance(v, (list, tuple)) else [v] for k, v in accounts.items()}
+        # Add the main account to the list of alt accounts
+        accounts.setdefault(home_region, []).append(main_name)
+        all_accounts.append(accounts)
+    return all_accounts
+
+
+def parse_account_list(account_list) -> dict:
+    """Returns an Account_list dictionary, parsing it if it is the string a CSV stores, e.g. "{'NA:': ['name 1']}" """
+    return ast.literal_eval(account_list) if isinstance(account_list, str) else account_list
+
+
+def roster_account_lists(roster_df: pd.DataFrame) -> list:
+    """Returns the Account_list dictionary of every pro of the roster. The Account_list column of a roster read
+    from a CSV (e.g. pro_mastery.csv) holds the dictionaries as strings, they are parsed here.
+    Without an Account_list column, the dictionaries are built from the ids column with build_account_list
+
+    Returns:
+        list: A list of dictionaries in the form {"NA:": ["name 1", "name 2"]}, one per row
+    """
+    if "Account_list" not in roster_df.columns:
+        return build_account_list(roster_df)
+    return [parse_account_list(a) for a in roster_df["Account_list"]]
+
+
+def account_identity(record: dict):
+    """Returns the (platform, puuid) of a checkpoint record, the same for every name and region alias of an account.
+    None for failed records
+    """
+    if "puuid" not in record:
+        return None
+    region = str(record["region"]).upper()
+    return RiotAnalyzer.regionDict.get(region, region.lower()), record["puuid"]
+
+
+def account_keys(account_list: dict) -> list:
+    """Turns one Account_list dictionary into a list of unique (region, summoner name) tuples
+
+    Args:
+        account_list (dict): A dictionary in the form {"NA:": ["name 1", "name 2"]}, or its string
+
+    Returns:
+        list: A list of (region, summoner name) tuples, e.g. [("NA", "name 1"), ("NA", "name 2")]
+    """
+    keys = []
+    for region, names in parse_account_list(account_list).items():
+        region = str(region).replace(":", "").strip().upper()
+        for name in names:
+            key = (region, str(name).strip())
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def unique_records(keys: list, results: dict, counted: set = None) -> list:
+    """Returns the checkpoint records with mastery of the (region, name) accounts, without the accounts
+    already counted: an account listed several times (under another name, region alias or pro) is only counted once
+
+    Args:
+        keys (list): (region, name) tuples, e.g. from account_keys
+        results (dict): The (region, name) -> checkpoint record results of MasteryPipeline.run
+        counted (set, optional): The account_identity of the accounts counted so far, updated in place.
+            Pass the same set for every pro of a roster. Defaults to None, a new set.
+    """
+    counted = set() if counted is None else counted
+    records = []
+    for key in keys:
+        record = results.get(key)
+        if record is None or "mastery" not in record or account_identity(record) in counted:
+            continue
+        counted.add(account_identity(record))
+        records.append(record)
+    return records
+
+
+class MasteryPipeline:
+    """Fetches the champion mastery of every account of every pro in the roster,
+    checkpointing each account's result to a JSON lines file as soon as it arrives.
+
+    Running the pipeline again resumes from the checkpoint: accounts that were already fetched are skipped,
+    and with max_age only the ones older than max_age seconds are fetched again, bypassing the response cache.
+    The checkpoint is rewritten with only the latest record of each account at the end of every run.
+    Accounts that fail are reported separately instead of being counted as zero mastery.
+    With an AccountIndex, the puuids come from the index instead of one summoner request per account,
+    and accounts listed several times (under another name, region alias or pro) are only fetched once.
+    """
+
+    def __init__(self, analyzer: RiotAnalyzer, checkpoint_path: str = "mastery_checkpoint.jsonl", account_index=None):
+        self.analyzer = analyzer
+        self.checkpoint_path = checkpoint_path
+        self.account_index = account_index
+        # The listings dropped by the last run because they are the same account as another listing
+        self.duplicates = None
+        self.lock = threading.Lock()
+        # (region, name) -> {"region", "name", "puuid", "fetched_at", "mastery"}
+        self.results = {}
+        # (region, name) -> {"region", "name", "error", "failed_at"}
+        self.failures = {}
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        """Loads the results saved by previous runs. The last record of each account wins"""
+        self.results, self.failures = {}, {}
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line can be cut short if the previous run crashed while writing it
+                    continue
+                key = (record["region"], record["name"])
+                if "error" in record:
+                    self.failures[key] = record
+                else:
+                    self.results[key] = record
+                    self.failures.pop(key, None)
+
+    def __save(self, record: dict):
+        with self.lock:
+            key = (record["region"], record["name"])
+            if "error" in record:
+                self.failures[key] = record
+            else:
+                self.results[key] = record
+                self.failures.pop(key, None)
+            with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def compact_checkpoint(self):
+        """Rewrites the checkpoint with only the latest record of each account, the older ones are never read again"""
+        with self.lock:
+            with open(self.checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+                for record in [*self.results.values(), *self.failures.values()]:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def fetch_account(self, region: str, name: str, use_cache: bool = None) -> dict:
+        """Fetches the mastery of one account and saves it to the checkpoint.
+        Failures are saved as well, and returned instead of raised.
+        use_cache=False refetches the mastery even if the response cache has it.
+        """
+        try:
+            # Region names (NA) and platform codes (na1, NA1) are both accepted, like account_identity
+            if str(region).upper() in self.analyzer.regionDict:
+                platform = self.analyzer.regionDict[str(region).upper()]
+            elif str(region).lower() in self.analyzer.regionDict.values():
+                platform = str(region).lower()
+            else:
+                raise Exception(f"Region {region} not found")
+            if self.account_index is not None:
+                puuid = self.account_index.resolve(platform, name)
+            else:
+                puuid = self.analyzer.get_puuid(name, platform)
+            mastery = self.analyzer.get_mastery(puuid, platform, use_cache)
+            record = {"region": region, "name": name, "puuid": puuid, "fetched_at": time.time(),
+                      "mastery": [{field: m[field] for field in mastery_fields} for m in mastery]}
+        except Exception as e:
+            record = {"region": region, "name": name, "error": str(e), "failed_at": time.time()}
+        self.__save(record)
+        return record
+
+    def fetch_puuid(self, puuid: str, accounts: list, use_cache: bool = None) -> list:
+        """Fetches the mastery of one resolved account once, and saves it for every (region, name) it is listed as.
+        use_cache=False refetches the mastery even if the response cache has it.
+
+        Returns:
+            list: The records of the accounts
+        """
+        region = accounts[0][0]
+        try:
+            mastery = self.analyzer.get_mastery(puuid, region, use_cache)
+            mastery = [{field: m[field] for field in mastery_fields} for m in mastery]
+            records = [{"region": region, "name": name, "puuid": puuid, "fetched_at": time.time(), "mastery": mastery}
+                       for region, name in accounts]
+        except Exception as e:
+            records = [{"region": region, "name": name, "error": str(e), "failed_at": time.time()}
+                       for region, name in accounts]
+        for record in records:
+            self.__save(record)
+        return records
+
+    def pending_accounts(self, accounts: list, max_age: float = None) -> list:
+        """Returns the accounts that still have to be fetched: the ones that are not in the checkpoint,
+        and if max_age is given, the ones fetched more than max_age seconds ago
+        """
+        now = time.time()
+        pending = []
+        for key in accounts:
+            record = self.results.get(key)
+            if record is None or (max_age is not None and now - record["fetched_at"] > max_age):
+                pending.append(key)
+        return pending
+
+    def run(self, roster_df: pd.DataFrame, max_age: float = None, verbose: bool = True, exporter=None):
+        """Fetches the mastery of every account in the roster that is not already in the checkpoint
+
+        Args:
+            roster_df (pd.DataFrame): The pro dataframe, e.g. read from pro_mastery.csv. Uses the Account_list column
+                if it exists, otherwise builds it from the Region, Official Summoner Name and ids columns
+            max_age (float, optional): Incremental mode, also refetches the accounts fetched more than max_age
+                seconds ago. Defaults to None, which only fetches the accounts missing from the checkpoint.
+            verbose (bool, optional): Reports the progress as info events, shown by the default sink.
+                Otherwise they are debug events. Defaults to True.
+            exporter (MasteryExporter, optional): Every pro is exported as soon as its accounts and those of the pros
+                before it are done, and the export is closed at the end of the run. Defaults to None.
+
+        Returns:
+            tuple: (results, failures). results maps every (region, name) account of the roster that has data
+                to its checkpoint record, failures is a DataFrame with the pro, region, name and error of the
+                accounts that could not be fetched
+        """
+        pro_accounts = [account_keys(a) for a in roster_account_lists(roster_df)]
+
+        failed = set()
+        if self.account_index is not None:
+            # Resolve every account from the index first, and drop the listings of an account already listed
+            pro_accounts, duplicates, errors = self.account_index.collapse(pro_accounts)
+            duplicates["pro"] = roster_df.index[duplicates["pro"].to_numpy(dtype=int)]
+            duplicates["kept_pro"] = roster_df.index[duplicates["kept_pro"].to_numpy(dtype=int)]
+            self.duplicates = duplicates
+            for (region, name), error in errors.items():
+                self.__save({"region": region, "name": name, "error": error, "failed_at": time.time()})
+                failed.add((region, name))
+
+        # An account listed under several pros is only fetched once
+        accounts = list(dict.fromkeys(key for keys in pro_accounts for key in keys))
+        pending = [key for key in self.pending_accounts(accounts, max_age) if key not in failed]
+        level = "info" if verbose else "debug"
+        metrics = self.analyzer.metrics
+        metrics.event("pipeline_started", level,
+                      f"{len(accounts)} accounts, {len(accounts) - len(pending)} from checkpoint, {len(pending)} to fetch",
+                      accounts=len(accounts), checkpointed=len(accounts) - len(pending), pending=len(pending))
+        if self.duplicates is not None and len(self.duplicates):
+            metrics.event("pipeline_duplicates", level, f"{len(self.duplicates)} duplicate listings dropped",
+                          duplicates=len(self.duplicates))
+
+        # Accounts already in the checkpoint are refetched because they are too old,
+        # the response cache could return the same stale mastery
+        def use_cache(keys):
+            return False if any(key in self.results for key in keys) else None
+
+        if self.account_index is not None:
+            # One mastery request per puuid, however many names it is listed as
+            groups = {}
+            for key in pending:
+                puuid = self.account_index.lookup(*key)
+                groups.setdefault((self.account_index.platform(key[0]), puuid), []).append(key)
+            futures = [self.analyzer.engine.submit(self.fetch_puuid, puuid, keys, use_cache(keys))
+                       for (_, puuid), keys in groups.items()]
+        else:
+            futures = [self.analyzer.engine.submit(self.fetch_account, region, name, use_cache([(region, name)]))
+                       for region, name in pending]
+
+        # The pros still waiting for some of their accounts, and the pros of every pending account
+        pending_keys = set(pending)
+        waiting = {pro: set(keys) & pending_keys for pro, keys in enumerate(pro_accounts)}
+        account_pros = {}
+        for pro, keys in waiting.items():
+            for key in keys:
+                account_pros.setdefault(key, []).append(pro)
+
+        # Pros are exported in roster order, as soon as their accounts and those of every pro before them are done,
+        # so an account listed under several pros is counted for the same pro as in MasteryMatrix.from_results
+        exported = 0
+
+        def export():
+            nonlocal exported
+            while exporter is not None and exported < len(pro_accounts) and not waiting[exported]:
+                exporter.add_pro(roster_df.index[exported], roster_df.iloc[exported], pro_accounts[exported], self.results)
+                exported += 1
+
+        export()
+        for done, future in enumerate(as_completed(futures), 1):
+            records = future.result()
+            for record in records if isinstance(records, list) else [records]:
+                key = (record["region"], record["name"])
+                if "error" in record:
+                    failed.add(key)
+                for pro in account_pros.get(key, []):
+                    waiting[pro].discard(key)
+            export()
+            if done % 50 == 0 or done == len(futures):
+                metrics.event("pipeline_progress", level, f"Fetched {done}/{len(futures)} accounts, {len(failed)} failed",
+                              done=done, total=len(futures), failed=len(failed))
+
+        results = {key: self.results[key] for key in accounts if key in self.results}
+        failures = []
+        for idx, keys in zip(roster_df.index, pro_accounts):
+            for key in keys:
+                if key in failed or key not in results:
+                    error = self.failures.get(key, {}).get("error", "Not fetched")
+                    failures.append({"pro": idx, "region": key[0], "name": key[1], "error": error})
+        failures = pd.DataFrame(failures, columns=["pro", "region", "name", "error"])
+        self.compact_checkpoint()
+        if exporter is not None:
+            exporter.close()
+        return results, failures
@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+
+from MasteryMatrix import MasteryMatrix
+from MasteryPipeline import account_keys, roster_account_lists, unique_records
+
+
+class SimilarityIndex:
+    """Finds the pros that play like a given pro, and the pros most associated with a champion,
+    from their champion mastery vectors.
+
+    Every pro's mastery points are log scaled (so a 3M point main doesn't drown out the rest of the pool)
+    and normalized to unit length once, so the cosine similarity of every pair is a plain dot product and
+    a query is a single matrix product over the whole index.
+    In approximate mode the vectors are also projected on their first few principal axes: a query ranks every pro
+    in the small space and only the best candidates are ranked again with the full vectors.
+    """
+
+    def __init__(self, pros: pd.Index, champion_ids: list, points: np.ndarray, aliases: dict = None,
+                 champion_dict: dict = None, approximate: bool = False, dimensions: int = None, variance: float = 0.9,
+                 candidates: int = 10):
+        """
+        Args:
+            pros (pd.Index): One entry per row of points, e.g. the index of the pro dataframe
+            champion_ids (list): The champion id of each column of points, as ints
+            points (np.ndarray): The mastery points matrix, of shape (len(pros), len(champion_ids))
+            aliases (dict, optional): Lowercase summoner name -> pro, used to look pros up by name. Defaults to None.
+            champion_dict (dict, optional): The champion map from RiotAnalyzer.get_champion_dict,
+                used to look champions up by name. Defaults to None.
+            approximate (bool, optional): Ranks the candidates in a projection first. Defaults to False.
+            dimensions (int, optional): The number of principal axes of the projection. Defaults to None,
+                as many as needed to keep variance of the vectors' energy.
+            variance (float, optional): The share of the energy kept when dimensions is None. Defaults to 0.9.
+            candidates (int, optional): How many candidates per result are ranked again exactly. Defaults to 10.
+        """
+        self.pros = pd.Index(pros)
+        self.rows = {pro: i for i, pro in enumerate(self.pros)}
+        self.champion_ids = [int(c) for c in champion_ids]
+        self.columns = {c: i for i, c in enumerate(self.champion_ids)}
+        self.aliases = dict(aliases or {})
+        self.champion_names = {str(name).lower(): int(key) for key, name in (champion_dict or {}).items()}
+        self.approximate = approximate
+        self.candidates = candidates
+
+        self.vectors = self.normalize(np.asarray(points, dtype=np.float64))
+        if approximate:
+            # The axes are computed once, pros updated later are projected on the same axes
+            _, singular_values, axes = np.linalg.svd(self.vectors, full_matrices=False)
+            if dimensions is None:
+                energy = np.cumsum(singular_values ** 2) / max(np.sum(singular_values ** 2), 1e-12)
+                dimensions = int(np.searchsorted(energy, variance)) + 1
+            self.projection = np.ascontiguousarray(axes[:dimensions].T, dtype=np.float32)
+            self.projected = self.vectors @ self.projection
+
+    @classmethod
+    def from_matrix(cls, matrix: MasteryMatrix, roster_df: pd.DataFrame = None, champion_dict: dict = None, **kwargs):
+        """Builds the index from a MasteryMatrix
+
+        Args:
+            matrix (MasteryMatrix): The pros x champions mastery matrix
+            roster_df (pd.DataFrame, optional): The pro dataframe of the matrix. If given, pros can be looked up
+                by their official summoner name and the names of their accounts. Defaults to None.
+            champion_dict (dict, optional): The champion map, to look champions up by name. Defaults to None.
+            **kwargs: The approximate mode options of SimilarityIndex
+        """
+        aliases = roster_aliases(roster_df) if roster_df is not None else None
+        return cls(matrix.pros, matrix.champion_ids, matrix.points, aliases, champion_dict, **kwargs)
+
+    @staticmethod
+    def normalize(points: np.ndarray) -> np.ndarray:
+        """Log scales the mastery points and scales every row to unit length. Rows without mastery stay 0"""
+        vectors = np.log1p(np.maximum(points, 0))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0).astype(np.float32)
+
+    def pro(self, pro_or_name):
+        """Finds a pro by its index label, or by one of its summoner names"""
+        if pro_or_name in self.rows:
+            return pro_or_name
+        if isinstance(pro_or_name, str) and pro_or_name.strip().lower() in self.aliases:
+            return self.aliases[pro_or_name.strip().lower()]
+        raise Exception(f"Pro {pro_or_name} not found")
+
+    def champion(self, champion) -> int:
+        """Finds the column of a champion by its id or name"""
+        if isinstance(champion, str) and not champion.isdigit():
+            if champion.lower() not in self.champion_names:
+                raise Exception(f"Champion {champion} not found")
+            champion = self.champion_names[champion.lower()]
+        if int(champion) not in self.columns:
+            raise Exception(f"Champion {champion} not found")
+        return self.columns[int(champion)]
+
+    def __top(self, scores: np.ndarray, k: int):
+        """Returns the indices of the k highest scores of each row, best first"""
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return np.empty((scores.shape[0], 0), dtype=np.intp)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1)
+
+    def __similarities(self, queries: np.ndarray, k: int):
+        """Returns the indices and the cosine similarities of the k nearest rows of each query vector"""
+        if not self.approximate:
+            scores = queries @ self.vectors.T
+            top = self.__top(scores, k)
+            return top, np.take_along_axis(scores, top, axis=1)
+        # Rank everything in the projection, then only the best candidates with the full vectors
+        candidates = self.__top((queries @ self.projection) @ self.projected.T, k * self.candidates)
+        scores = np.einsum("qd,qcd->qc", queries, self.vectors[candidates])
+        top = self.__top(scores, k)
+        return np.take_along_axis(candidates, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+    def nearest(self, pro_or_name, k: int = 10) -> pd.DataFrame:
+        """Finds the k pros whose champion pools are the most similar to a pro's
+
+        Args:
+            pro_or_name: The index label of the pro, or one of its summoner names
+            k (int, optional): The number of pros. Defaults to 10.
+
+        Returns:
+            pd.DataFrame: The k pros indexed like the pro dataframe, most similar first, with their similarity (0 to 1).
+                Pros without any champion in common are left out
+        """
+        return self.nearest_many([pro_or_name], k)[0]
+
+    def nearest_many(self, pros: list, k: int = 10, batch_size: int = 1024) -> list:
+        """Runs nearest for many pros at once, batch_size queries per matrix product
+
+        Returns:
+            list: One dataframe per pro, like nearest
+        """
+        rows = np.array([self.rows[self.pro(pro)] for pro in pros], dtype=np.intp)
+        results = []
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            # One extra result, the pro itself, is dropped
+            top, scores = self.__similarities(self.vectors[batch], k + 1)
+            for row, indices, similarities in zip(batch, top, scores):
+                keep = (indices != row) & (similarities > 0)
+                results.append(self.__frame(indices[keep][:k], similarities[keep][:k], "similarity"))
+        return results
+
+    def nearest_to(self, points: dict, k: int = 10) -> pd.DataFrame:
+        """Finds the k pros whose champion pools are the most similar to any mastery, e.g. a soloq player's
+
+        Args:
+            points (dict): Champion id -> mastery points
+        """
+        vector = self.normalize(self.__row(points)[None, :])
+        top, scores = self.__similarities(vector, k)
+        keep = scores[0] > 0
+        return self.__frame(top[0][keep], scores[0][keep], "similarity")
+
+    def champion_pros(self, champion, k: int = 10) -> pd.DataFrame:
+        """Finds the k pros most associated with a champion, i.e. with the largest weight of that champion
+        in their normalized mastery vector
+
+        Args:
+            champion: The champion id or name
+        """
+        weights = self.vectors[:, self.champion(champion)]
+        top = self.__top(weights[None, :], k)[0]
+        top = top[weights[top] > 0]
+        return self.__frame(top, weights[top], "weight")
+
+    def __frame(self, indices: np.ndarray, values: np.ndarray, column: str) -> pd.DataFrame:
+        return pd.DataFrame({column: values.astype(np.float64)}, index=self.pros[indices])
+
+    def __row(self, points) -> np.ndarray:
+        """Turns champion id -> points into a row of the index, adding a column for champions it doesn't have yet"""
+        if not isinstance(points, dict):
+            return np.asarray(points, dtype=np.float64)
+        for champion_id in points:
+            if int(champion_id) not in self.columns:
+                self.__add_champion(int(champion_id))
+        row = np.zeros(len(self.champion_ids), dtype=np.float64)
+        for champion_id, value in points.items():
+            row[self.columns[int(champion_id)]] += value
+        return row
+
+    def __add_champion(self, champion_id: int):
+        self.columns[champion_id] = len(self.champion_ids)
+        self.champion_ids.append(champion_id)
+        self.vectors = np.hstack([self.vectors, np.zeros((len(self.vectors), 1), dtype=np.float32)])
+        if self.approximate:
+            self.projection = np.vstack([self.projection, np.zeros((1, self.projection.shape[1]), dtype=np.float32)])
+
+    def update(self, pro, points, aliases: list = None):
+        """Replaces the mastery of one pro, or adds a new pro, without rebuilding the index
+
+        Args:
+            pro: The index label of the pro
+            points (dict or np.ndarray): Champion id -> mastery points summed over the pro's accounts,
+                or a full row in the order of champion_ids
+            aliases (list, optional): Summoner names to look the pro up by. Defaults to None.
+        """
+        vector = self.normalize(self.__row(points)[None, :])[0]
+        if pro in self.rows:
+            row = self.rows[pro]
+            self.vectors[row] = vector
+        else:
+            row = len(self.pros)
+            self.rows[pro] = row
+            self.pros = self.pros.append(pd.Index([pro]))
+            self.vectors = np.vstack([self.vectors, vector[None, :]])
+        if self.approximate:
+            if row < len(self.projected):
+                self.projected[row] = vector @ self.projection
+            else:
+                self.projected = np.vstack([self.projected, (vector @ self.projection)[None, :]])
+        for name in aliases or []:
+            self.aliases[str(name).strip().lower()] = pro
+
+    def update_from_results(self, pro, account_list: dict, results: dict):
+        """Replaces the mastery of one pro with its accounts' records from MasteryPipeline.run
+
+        Args:
+            pro: The index label of the pro
+            account_list (dict): The pro's Account_list dictionary, e.g. {"NA:": ["name 1"]}, or its string
+            results (dict): The (region, name) -> checkpoint record results of the pipeline
+        """
+        points = {}
+        keys = account_keys(account_list)
+        for record in unique_records(keys, results):
+            for m in record["mastery"]:
+                points[int(m["championId"])] = points.get(int(m["championId"]), 0) + m["championPoints"]
+        self.update(pro, points, [name for _, name in keys])
+
+
+def roster_aliases(roster_df: pd.DataFrame) -> dict:
+    """Maps the lowercase official summoner name and account names of every pro to its index label"""
+    aliases = {}
+    for pro, account_list in zip(roster_df.index, roster_account_lists(roster_df)):
+        for _, name in account_keys(account_list):
+            aliases.setdefault(name.lower(), pro)
+    for pro, name in zip(roster_df.index, roster_df["Official Summoner Name"]):
+        aliases[str(name).strip().lower()] = pro
+    return aliases
@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+import time
+
+from Metrics import metrics as default_metrics
+
+
+class MatchStore:
+    """A compact SQLite store of match-v5 games, one row per match and one row per participant.
+
+    Only the fields needed to compare champions and results are kept, every participant of a game is stored
+    (not only the tracked players) so the opponents and teammates of a pro can be analyzed too.
+    The store also remembers up to when the match history of every tracked puuid was synced, which is used as the
+    startTime of the next sync so only newer games are paged. A sync stopped by its max_matches leaves a cursor instead:
+    the start of the oldest game it paged, used as the endTime of the next sync so it carries on with the older games.
+    """
+
+    def __init__(self, path: str = "matches.sqlite", metrics=None):
+        self.path = path
+        self.metrics = metrics or default_metrics
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS matches ("
+                "match_id TEXT PRIMARY KEY, platform TEXT, queue_id INTEGER, game_start INTEGER, "
+                "game_duration INTEGER, game_version TEXT)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS participants ("
+                "match_id TEXT, puuid TEXT, champion_id INTEGER, team_id INTEGER, team_position TEXT, win INTEGER, "
+                "kills INTEGER, deaths INTEGER, assists INTEGER, cs INTEGER, gold INTEGER, "
+                "PRIMARY KEY (match_id, puuid)) WITHOUT ROWID")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS participants_puuid ON participants (puuid)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS players (puuid TEXT PRIMARY KEY, region TEXT, synced_until INTEGER)")
+            # Added after the first version of the table
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(players)")]
+            for column in ["cursor", "cursor_synced_until"]:
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE players ADD COLUMN {column} INTEGER")
+
+    def known_matches(self, match_ids: list) -> set:
+        """Returns the match ids that are already stored"""
+        match_ids = list(match_ids)
+        known = set()
+        with self.lock:
+            # SQLite limits the number of parameters of a query
+            for i in range(0, len(match_ids), 500):
+                chunk = match_ids[i:i + 500]
+                rows = self.connection.execute(
+                    f"SELECT match_id FROM matches WHERE match_id IN ({','.join('?' * len(chunk))})", chunk)
+                known.update(row[0] for row in rows)
+        return known
+
+    def add_match(self, match: dict):
+        """Stores a match-v5 response and its participants"""
+        info = match["info"]
+        match_id = match["metadata"]["matchId"]
+        participants = [
+            (match_id, p["puuid"], p["championId"], p["teamId"], p.get("teamPosition") or None, int(p["win"]),
+             p["kills"], p["deaths"], p["assists"], p.get("totalMinionsKilled", 0) + p.get("neutralMinionsKilled", 0),
+             p.get("goldEarned", 0))
+            for p in info["participants"]]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO matches (match_id, platform, queue_id, game_start, game_duration, game_version) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (match_id, info.get("platformId"), info.get("queueId"), info.get("gameStartTimestamp"),
+                 info.get("gameDuration"), info.get("gameVersion")))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO participants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", participants)
+        self.metrics.count("match_store_writes_total")
+
+    def synced_until(self, puuid: str):
+        """Returns the epoch seconds up to which the match history of the puuid is stored, None if it was never synced"""
+        with self.lock:
+            row = self.connection.execute("SELECT synced_until FROM players WHERE puuid = ?", (puuid,)).fetchone()
+        return row[0] if row else None
+
+    def last_game_start(self, puuid: str):
+        """Returns the start of the newest stored game of the puuid in epoch seconds, None if it has no stored game"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MAX(m.game_start) FROM participants p JOIN matches m ON m.match_id = p.match_id "
+                "WHERE p.puuid = ?", (puuid,)).fetchone()
+        return row[0] // 1000 if row and row[0] is not None else None
+
+    def oldest_game_start(self, match_ids: list):
+        """Returns the start of the oldest stored game of match_ids in epoch seconds, None if none is stored"""
+        match_ids = list(match_ids)
+        starts = []
+        with self.lock:
+            for i in range(0, len(match_ids), 500):
+                chunk = match_ids[i:i + 500]
+                row = self.connection.execute(
+                    f"SELECT MIN(game_start) FROM matches WHERE match_id IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchone()
+                if row[0] is not None:
+                    starts.append(row[0])
+        return min(starts) // 1000 if starts else None
+
+    def set_synced(self, puuid: str, region: str, synced_until: int = None):
+        """Records that every game of the puuid until synced_until (epoch seconds, defaults to now) is stored.
+        Clears the cursor of the puuid
+        """
+        if synced_until is None:
+            synced_until = int(time.time())
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO players (puuid, region, synced_until) VALUES (?, ?, ?)",
+                                    (puuid, region, synced_until))
+
+    def cursor(self, puuid: str):
+        """Returns the (cursor, cursor_synced_until) of a puuid whose last sync was stopped by max_matches, None otherwise.
+        The games between synced_until and cursor (epoch seconds) are still to be paged, and once they are,
+        the puuid is synced until cursor_synced_until
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT cursor, cursor_synced_until FROM players WHERE puuid = ?",
+                                          (puuid,)).fetchone()
+        return tuple(row) if row and row[0] is not None else None
+
+    def set_cursor(self, puuid: str, region: str, cursor: int, cursor_synced_until: int):
+        """Records that the games of the puuid after cursor are stored, but not the older ones since synced_until"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO players (puuid, region, cursor, cursor_synced_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (puuid) DO UPDATE SET cursor = excluded.cursor, "
+                "cursor_synced_until = excluded.cursor_synced_until",
+                (puuid, region, cursor, cursor_synced_until))
+
+    def load_participants(self, puuids: list = None, tracked_only: bool = False):
+        """Loads the participants table joined with the match data
+
+        Args:
+            puuids (list, optional): Only load the rows of these players. Defaults to None, every player.
+            tracked_only (bool, optional): Only load the rows of the synced players. Defaults to False.
+
+        Returns:
+            pd.DataFrame: One row per match and participant, with compact dtypes
+        """
+        import pandas as pd
+
+        query = ("SELECT p.match_id, m.platform, m.queue_id, m.game_start, m.game_duration, m.game_version, "
+                 "p.puuid, p.champion_id, p.team_id, p.team_position, p.win, p.kills, p.deaths, p.assists, p.cs, p.gold "
+                 "FROM participants p JOIN matches m ON m.match_id = p.match_id")
+        params = []
+        if tracked_only:
+            query += " WHERE p.puuid IN (SELECT puuid FROM players)"
+        elif puuids is not None:
+            puuids = list(puuids)
+            query += f" WHERE p.puuid IN ({','.join('?' * len(puuids))})"
+            params = puuids
+        with self.lock:
+            df = pd.read_sql_query(query, self.connection, params=params)
+
+        df["game_start"] = pd.to_datetime(df["game_start"], unit="ms")
+        for column in ["match_id", "platform", "game_version", "puuid", "team_position"]:
+            df[column] = df[column].astype("category")
+        df["win"] = df["win"].astype(bool)
+        return df.astype({"queue_id": "int16", "game_duration": "int32", "champion_id": "int16", "team_id": "int16",
+                          "kills": "int16", "deaths": "int16", "assists": "int16", "cs": "int16", "gold": "int32"})
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
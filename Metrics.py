@@ -0,0 +1,220 @@
+import bisect
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# Upper bounds of the histogram buckets, in seconds
+default_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and count"""
+
+    def __init__(self, buckets: list = default_buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        return {"buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+                "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    """Collects counters, latency histograms and structured events from the hot paths
+    (RequestEngine, ResponseCache, RiotAnalyzer, LeaguepediaScraper, LoG_parser).
+
+    Counters and histograms are aggregated in memory and can be read with snapshot() or prometheus().
+    Events are passed to every sink as soon as they happen, and flush() hands the aggregated metrics to the sinks.
+    """
+
+    def __init__(self, sinks: list = None):
+        self.lock = threading.Lock()
+        self.sinks = list(sinks or [])
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def __key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Adds value to the counter name with the given labels, e.g. count("riot_requests_total", region="na1")"""
+        key = self.__key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Adds one observation to the histogram name with the given labels"""
+        key = self.__key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Times the body of the with block into the histogram name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def event(self, name: str, level: str = "info", message: str = None, **fields):
+        """Sends a structured event to every sink
+
+        Args:
+            name (str): The name of the event, e.g. rate_limited
+            level (str, optional): debug, info or warning. Defaults to "info".
+            message (str, optional): A human readable description of the event. Defaults to None.
+        """
+        event = {"time": time.time(), "event": name, "level": level, **fields}
+        if message is not None:
+            event["message"] = message
+        for sink in list(self.sinks):
+            sink.emit(event)
+
+    def snapshot(self) -> dict:
+        """Returns the current value of every counter and histogram"""
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+            histograms = [{"name": name, "labels": dict(labels), **histogram.snapshot()}
+                          for (name, labels), histogram in self.histograms.items()]
+        return {"time": time.time(), "counters": counters, "histograms": histograms}
+
+    def prometheus(self) -> str:
+        """Returns every counter and histogram in the Prometheus text exposition format"""
+        return prometheus_text(self.snapshot())
+
+    def flush(self):
+        """Hands the aggregated metrics to the sinks that export them"""
+        snapshot = self.snapshot()
+        for sink in list(self.sinks):
+            sink.flush(snapshot)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _labels_text(labels: dict, extra: dict = None) -> str:
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{_metric_name(k)}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def prometheus_text(snapshot: dict) -> str:
+    """Formats a Metrics.snapshot() in the Prometheus text exposition format"""
+    lines = []
+    typed = set()
+    for counter in sorted(snapshot["counters"], key=lambda c: c["name"]):
+        name = _metric_name(counter["name"])
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels_text(counter['labels'])} {counter['value']}")
+    for histogram in sorted(snapshot["histograms"], key=lambda h: h["name"]):
+        name = _metric_name(histogram["name"])
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for le, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels_text(histogram['labels'], {'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{_labels_text(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels_text(histogram['labels'])} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class InMemorySink:
+    """Keeps the last max_events events and the last flushed snapshot in memory"""
+
+    def __init__(self, max_events: int = 10000):
+        self.events = deque(maxlen=max_events)
+        self.last_snapshot = None
+
+    def emit(self, event: dict):
+        self.events.append(event)
+
+    def flush(self, snapshot: dict):
+        self.last_snapshot = snapshot
+
+
+class JsonLinesSink:
+    """Appends every event, and every flushed snapshot, as one JSON line to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __write(self, record: dict):
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def emit(self, event: dict):
+        self.__write(event)
+
+    def flush(self, snapshot: dict):
+        self.__write({"event": "metrics", **snapshot})
+
+
+class PrometheusSink:
+    """Writes the flushed metrics to a file in the Prometheus text format, e.g. for the node exporter textfile collector"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def emit(self, event: dict):
+        pass
+
+    def flush(self, snapshot: dict):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text(snapshot))
+
+
+class ConsoleSink:
+    """Prints the message of the events of the given levels, like the prints it replaces"""
+
+    def __init__(self, levels: tuple = ("info", "warning")):
+        self.levels = levels
+
+    def emit(self, event: dict):
+        if event["level"] in self.levels and "message" in event:
+            print(event["message"])
+
+    def flush(self, snapshot: dict):
+        pass
+
+
+# The registry used by default by every instrumented class
+metrics = Metrics(sinks=[ConsoleSink()])
@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from MasteryPipeline import account_keys, roster_account_lists
+from Metrics import metrics as default_metrics
+
+
+def version_key(version: str) -> tuple:
+    """Sorts versions like 13.9.1 before 13.17.1"""
+    return tuple(int(part) if part.isdigit() else part for part in str(version).split("."))
+
+
+def champion_diff(old: dict, new: dict) -> dict:
+    """Compares the champion.json data of two versions, champion by key (the champion id of the Riot API)
+
+    Returns:
+        dict: {"added": [keys], "removed": [keys], "renamed": [{"key", "old_id", "new_id", "old_name", "new_name"}],
+            "tags": [{"key", "old", "new"}], "stats": [{"key", "changes": {stat: [old, new]}}]}
+    """
+    old = {c["key"]: c for c in old["data"].values()}
+    new = {c["key"]: c for c in new["data"].values()}
+    diff = {"added": sorted(new.keys() - old.keys(), key=int), "removed": sorted(old.keys() - new.keys(), key=int),
+            "renamed": [], "tags": [], "stats": []}
+    for key in sorted(old.keys() & new.keys(), key=int):
+        before, after = old[key], new[key]
+        if before["id"] != after["id"] or before["name"] != after["name"]:
+            diff["renamed"].append({"key": key, "old_id": before["id"], "new_id": after["id"],
+                                    "old_name": before["name"], "new_name": after["name"]})
+        if before.get("tags", []) != after.get("tags", []):
+            diff["tags"].append({"key": key, "old": before.get("tags", []), "new": after.get("tags", [])})
+        before_stats, after_stats = before.get("stats", {}), after.get("stats", {})
+        changes = {stat: [before_stats.get(stat), after_stats.get(stat)]
+                   for stat in sorted(before_stats.keys() | after_stats.keys())
+                   if before_stats.get(stat) != after_stats.get(stat)}
+        if changes:
+            diff["stats"].append({"key": key, "changes": changes})
+    return diff
+
+
+class PatchTracker:
+    """Keeps the champion.json of every version the project has seen, compares each new version with the
+    previous one, and marks the derived data the changes make stale, so only that data has to be rebuilt on patch day.
+
+    What goes stale:
+        role_row: the role table row (Champs_w_roles.xlsx) of new champions, and of champions whose tags or stats
+            changed, since their play rates per role move
+        mastery_frame: the mastery frames of the accounts with mastery on a renamed or removed champion,
+            since their championName column is out of date
+        score: the scores of every pro if champions were added or removed (the onetrick score depends on the
+            champion count), otherwise the scores of the pros with mastery on a champion whose role row is stale
+
+    The marks are kept in SQLite until clear() is called for the rebuilt data.
+    """
+
+    def __init__(self, analyzer, root: str = "patches", path: str = "patches.sqlite", metrics=None):
+        """
+        Args:
+            analyzer (RiotAnalyzer): Fetches the champion data
+            root (str, optional): The folder of the champion.json files. Defaults to "patches".
+            path (str, optional): The SQLite file of the diffs and stale marks. Defaults to "patches.sqlite".
+        """
+        self.analyzer = analyzer
+        self.root = root
+        self.metrics = metrics or default_metrics
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS diffs ("
+                "old_version TEXT, new_version TEXT, diff TEXT, created REAL, PRIMARY KEY (old_version, new_version))")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS stale ("
+                "kind TEXT, key TEXT, version TEXT, reason TEXT, marked_at REAL, PRIMARY KEY (kind, key))")
+
+    def json_path(self, version: str) -> str:
+        return os.path.join(self.root, f"champion_{version}.json")
+
+    def versions(self) -> list:
+        """Returns the versions whose champion.json is stored, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        versions = [name[len("champion_"):-len(".json")] for name in os.listdir(self.root)
+                    if name.startswith("champion_") and name.endswith(".json")]
+        return sorted(versions, key=version_key)
+
+    def load(self, version: str) -> dict:
+        """Returns the champion.json of a version, fetching and storing it if it isn't stored yet"""
+        path = self.json_path(version)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        data = self.analyzer.get_champion_data(version)
+        os.makedirs(self.root, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return data
+
+    def diff(self, old_version: str, new_version: str) -> dict:
+        """Returns the champion_diff of two versions, computed once and stored"""
+        with self.lock:
+            row = self.connection.execute("SELECT diff FROM diffs WHERE old_version = ? AND new_version = ?",
+                                          (old_version, new_version)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        diff = champion_diff(self.load(old_version), self.load(new_version))
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO diffs VALUES (?, ?, ?, ?)",
+                                    (old_version, new_version, json.dumps(diff), time.time()))
+        return diff
+
+    def update(self, version: str = None, results: dict = None, roster_df: pd.DataFrame = None) -> dict:
+        """Stores a new version, compares it with the newest stored version before it and marks what went stale.
+        The analyzer's version is stored first, since the derived data was built for it
+
+        Args:
+            version (str, optional): The new version. Defaults to the latest version on Data Dragon.
+            results (dict, optional): The (region, name) -> checkpoint record results of MasteryPipeline.run,
+                to find the accounts and pros with mastery on the changed champions. Defaults to None.
+            roster_df (pd.DataFrame, optional): The pro dataframe the pipeline was run on. Defaults to None.
+
+        Returns:
+            dict: The diff, or None if there was no earlier version to compare with
+        """
+        version = version or self.analyzer.get_versions()[0]
+        if version_key(self.analyzer.version) < version_key(version):
+            self.load(self.analyzer.version)
+        previous = [v for v in self.versions() if version_key(v) < version_key(version)]
+        self.load(version)
+        if not previous:
+            return None
+        diff = self.diff(previous[-1], version)
+        self.invalidate(diff, version, results, roster_df)
+        self.metrics.event("patch_diff", "info",
+                           f"{previous[-1]} -> {version}: {len(diff['added'])} new, {len(diff['removed'])} removed, "
+                           f"{len(diff['renamed'])} renamed, {len(diff['tags'])} tag and {len(diff['stats'])} stat changes",
+                           old_version=previous[-1], new_version=version,
+                           **{change: len(diff[change]) for change in ["added", "removed", "renamed", "tags", "stats"]})
+        return diff
+
+    def invalidate(self, diff: dict, version: str, results: dict = None, roster_df: pd.DataFrame = None):
+        """Marks the role rows, mastery frames and scores made stale by a diff, see the class docstring"""
+        role_keys = set(diff["added"]) | {c["key"] for c in diff["tags"]} | {c["key"] for c in diff["stats"]}
+        renamed_keys = {c["key"] for c in diff["renamed"]} | set(diff["removed"])
+        self.mark("role_row", role_keys, version, "champion changed")
+
+        if results is None:
+            return
+        accounts = {}
+        for key, record in results.items():
+            champions = {str(m["championId"]) for m in record.get("mastery", [])}
+            accounts[key] = champions
+            if champions & renamed_keys:
+                self.mark("mastery_frame", [f"{key[0]}/{key[1]}"], version, "champion renamed")
+
+        if roster_df is None:
+            return
+        count_changed = bool(diff["added"] or diff["removed"])
+        pros = []
+        for pro, account_list in zip(roster_df.index, roster_account_lists(roster_df)):
+            if count_changed or any(accounts.get(key, set()) & role_keys for key in account_keys(account_list)):
+                pros.append(str(pro))
+        self.mark("score", pros, version, "champion count changed" if count_changed else "champion roles changed")
+
+    def mark(self, kind: str, keys, version: str, reason: str):
+        """Marks data as stale, e.g. mark("role_row", ["266"], "13.18.1", "champion changed")"""
+        now = time.time()
+        rows = [(kind, str(key), version, reason, now) for key in keys]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO stale VALUES (?, ?, ?, ?, ?)", rows)
+        self.metrics.count("patch_stale_marks_total", len(rows), kind=kind)
+
+    def stale(self, kind: str) -> list:
+        """Returns the keys of the stale data of a kind: champion keys for role_row, "REGION/name" for mastery_frame
+        and the index label of the pro (as a string) for score
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT key FROM stale WHERE kind = ? ORDER BY key", (kind,)).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self, kind: str, keys=None):
+        """Unmarks the data that was rebuilt, or every stale data of the kind if keys is None"""
+        with self.lock, self.connection:
+            if keys is None:
+                self.connection.execute("DELETE FROM stale WHERE kind = ?", (kind,))
+            else:
+                self.connection.executemany("DELETE FROM stale WHERE kind = ? AND key = ?",
+                                            [(kind, str(key)) for key in keys])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,62 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
 import requests
 import pandas as pd
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+from Metrics import metrics as default_metrics
+
+# Use the C-backed lxml parser when it is installed, it is several times faster on the large wiki pages
+try:
+    import lxml  # noqa: F401
+    html_parser = "lxml"
+except ImportError:
+    html_parser = "html.parser"
+
+# Parse only the elements each step needs instead of building the tree of the whole page
+infobox_strainer = SoupStrainer("table", class_="infobox")
+link_strainer = SoupStrainer("a")
+
+disambiguation_text = "This disambiguation page lists articles associated with the same title."
+# The div holding the article of a wiki page, everything before it is the head, navigation and scripts
+content_marker = 'id="mw-content-text"'
 
 
 class LeaguepediaScraper:
     """Class to scrape data from Leaguepedia website regarding professional LOL players"""
 
-    def __init__(self):
+    def __init__(self, max_workers: int = 4, max_cached_pages: int = 256, metrics=None):
+        """
+        Args:
+            max_workers (int, optional): How many lookups get_pro_soloq_ids_many runs at once. Defaults to 4,
+                to stay polite with the wiki.
+            max_cached_pages (int, optional): How many search and disambiguation pages are kept, the pages shared
+                by several players, so they are only fetched once. Other pages are dropped as soon as no lookup
+                is waiting for them. Defaults to 256.
+        """
         self.url_template = "https://lol.fandom.com/wiki/{page}"
+        self.max_workers = max_workers
+        self.max_cached_pages = max_cached_pages
+        self.metrics = metrics or default_metrics
+
+        # A single keep-alive session shared by every lookup
+        self.session = requests.Session()
+        self.pool_maxsize = 0
+        self.__mount(max_workers)
+
+        self.lock = threading.Lock()
+        # url -> Future of the page's HTML, in least recently used order
+        self.pages = OrderedDict()
+        # url -> how many lookups are waiting for the page
+        self.waiting = {}
 
-    def __get_page(self, page) -> BeautifulSoup:
+    def __mount(self, pool_maxsize: int):
+        """Gives the session a connection pool of pool_maxsize connections, one per concurrent lookup"""
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_maxsize = pool_maxsize
+
+    def __release(self, url: str, future: Future):
+        """Drops the page once no lookup is waiting for it, unless it is a search or disambiguation page"""
+        with self.lock:
+            self.waiting[url] -= 1
+            if self.waiting[url]:
+                return
+            del self.waiting[url]
+            if self.pages.get(url) is not future:
+                return
+            shared = future.exception() is None and ("Special:Search" in url or disambiguation_text in future.result())
+            if not shared:
+                del self.pages[url]
+                return
+            kept = [key for key in self.pages if key not in self.waiting]
+            for key in kept[:max(0, len(kept) - self.max_cached_pages)]:
+                del self.pages[key]
+
+    def __fetch(self, url: str) -> str:
+        """Gets the HTML of the url. If another lookup is already fetching or has fetched the same url, reuses its result"""
+        with self.lock:
+            future = self.pages.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.pages[url] = future
+            else:
+                self.pages.move_to_end(url)
+            self.waiting[url] = self.waiting.get(url, 0) + 1
+        self.metrics.count("leaguepedia_page_lookups_total", result="fetch" if owner else "shared")
+        if owner:
+            try:
+                start = time.perf_counter()
+                response = self.session.get(url)
+                self.metrics.observe("leaguepedia_request_seconds", time.perf_counter() - start)
+                self.metrics.count("leaguepedia_requests_total", status=response.status_code)
+                future.set_result(response.text)
+            except Exception as e:
+                # Don't keep failures around, the next lookup will try again
+                with self.lock:
+                    if self.pages.get(url) is future:
+                        del self.pages[url]
+                future.set_exception(e)
+        try:
+            return future.result()
+        finally:
+            self.__release(url, future)
+
+    def __get_page(self, page) -> str:
         """Gets the HTML of the page"""
         url = self.url_template.format(page=page)
-        response = requests.get(url)
-        return BeautifulSoup(response.text, 'html.parser')
+        return self.__fetch(url)
 
-    def __special_search(self, search_term: str) -> BeautifulSoup:
-        """Searches for a player using the query in the search bar and returns the soup object of the page"""
+    def __special_search(self, search_term: str) -> str:
+        """Searches for a player using the query in the search bar and returns the HTML of the page"""
         url = self.url_template.format(
             page=f"Special:Search?query={search_term}")
-        response = requests.get(url)
-        return BeautifulSoup(response.text, 'html.parser')
+        return self.__fetch(url)
 
-    def __search_pro_page(self, summoner_name: str, given_name: str, family_name: str) -> BeautifulSoup:
+    def __search_pro_page(self, summoner_name: str, given_name: str, family_name: str) -> str:
         """Finds the page of the professional player, given their summoner name, and full name 
-        returns the soup object"""
+        returns the HTML of the page"""
         # First try the summoner name
-        soup = self.__get_page(summoner_name)
-        page_type = self.__check_page(soup)
+        html = self.__get_page(summoner_name)
+        page_type = self.__check_page(html)
 
         if page_type == "disambiguation":
             page = self.__find_disambiguation(
-                soup, summoner_name, given_name, family_name)
-            soup = self.__get_page(page)
+                html, summoner_name, given_name, family_name)
+            html = self.__get_page(page)
 
         elif page_type == "doesn't exist":
-            search_soup = self.__special_search(summoner_name)
+            search_html = self.__special_search(summoner_name)
             # Use the find_disambiguation function to find the correct link
             page = self.__find_disambiguation(
-                search_soup, summoner_name, given_name, family_name)
-            soup = self.__get_page(page)
+                search_html, summoner_name, given_name, family_name)
+            html = self.__get_page(page)
 
-        page_type = self.__check_page(soup)
+        page_type = self.__check_page(html)
         if page_type == "article":
-            return soup
+            return html
         
-        # If not found, print "Not Found"
-        print("Not Found")
+        # If not found, report "Not Found"
+        self.metrics.event("pro_page_not_found", "info", "Not Found", summoner_name=summoner_name)
         return None
 
-    def __find_disambiguation(self, soup: BeautifulSoup, summoner_name: str, first_name: str, family_name: str) -> str:
-        """Given a soup object containing a disambiguation page, find the correct link
+    def __find_disambiguation(self, html: str, summoner_name: str, first_name: str, family_name: str) -> str:
+        """Given the HTML of a disambiguation page, find the correct link
 
         Args:
-            soup (BeautifulSoup): the soup object for the disambiguation page
+            html (str): the HTML of the disambiguation page
             first_name (str): the player's first name
             family_name (str): the player's family name
         """
+        # Only the links are parsed
+        with self.metrics.timer("leaguepedia_parse_seconds", step="links"):
+            soup = BeautifulSoup(html, html_parser, parse_only=link_strainer)
         for link in soup.find_all("a"):
             if first_name in link.text or family_name in link.text:
                 # Return the href
@@ -64,36 +164,52 @@ class LeaguepediaScraper:
         else:
             raise Exception("Summoner Not Found")
 
-    def __check_page(self, soup):
+    def __check_page(self, html: str):
         # Check if the page is an article, a disambiguation page, or a "doesn't exist" page
 
         # If it's an article, return "article"
         article_text = "Soloqueue IDs"
 
-        # If it's a disambiguation page, return "disambiguation"
-        disambiguation_text = "This disambiguation page lists articles associated with the same title."
+        # If it's a disambiguation page, return "disambiguation", see disambiguation_text
 
         # If it's a "doesn't exist" page, return "doesn't exist"
         doesnt_exist_text = "There is currently no text in this page."
 
-        if doesnt_exist_text in soup.text:
+        # Fast path: the markers are plain text, so look for them in the raw HTML of the page content without
+        # parsing it. The head and its scripts can mention them too (e.g. the search box or page config)
+        content_start = html.find(content_marker)
+        if content_start >= 0:
+            content = html[content_start:]
+            if doesnt_exist_text in content:
+                return "doesn't exist"
+            elif disambiguation_text in content:
+                return "disambiguation"
+            elif article_text in content:
+                return "article"
+
+        # The markers can be split by tags or entities in the HTML, so fall back to the text of the whole page
+        with self.metrics.timer("leaguepedia_parse_seconds", step="check_page"):
+            text = BeautifulSoup(html, html_parser).text
+        if doesnt_exist_text in text:
             return "doesn't exist"
-        elif disambiguation_text in soup.text:
+        elif disambiguation_text in text:
             return "disambiguation"
-        elif article_text in soup.text:
+        elif article_text in text:
             return "article"
 
         # If it's something else, return "other"
         return "other"
 
-    def __parse_pro_soloq_ids(self, soup: BeautifulSoup) -> dict:
+    def __parse_pro_soloq_ids(self, html: str) -> dict:
+        # Only the infobox tables are parsed
+        with self.metrics.timer("leaguepedia_parse_seconds", step="infobox"):
+            soup = BeautifulSoup(html, html_parser, parse_only=infobox_strainer)
         # Go through the tables and look for <td class="infobox-label">Soloqueue IDs</td>
         tables = soup.find_all("table", class_="infobox")
 
         for table in tables:
             for row in table.find_all("tr"):
                 # If row.text starts with "Soloqueue IDs", save the row
-                search_string = "Soloqueue IDs"
                 if row.text.startswith("Soloqueue IDs"):
                     break
 
@@ -118,10 +234,40 @@ class LeaguepediaScraper:
         Returns:
             dict: A dictionary of the pro player's soloq ids with the region as keys and the ids as a list of strings
         """
-        soup = self.__search_pro_page(summoner_name, first_name, family_name)
-        ids = self.__parse_pro_soloq_ids(soup)
+        html = self.__search_pro_page(summoner_name, first_name, family_name)
+        if html is None:
+            raise Exception("Pro page not found")
+        ids = self.__parse_pro_soloq_ids(html)
         return ids
 
+    def get_pro_soloq_ids_many(self, players: list, max_workers: int = None) -> tuple:
+        """Finds the soloq ids of many pro players at once. The lookups run concurrently on a shared session,
+        and pages needed by several players are only fetched once
+
+        Args:
+            players (list): A list of (summoner_name, first_name, family_name) tuples
+            max_workers (int, optional): How many lookups run at once. Defaults to self.max_workers.
+
+        Returns:
+            tuple: (results, errors). results maps each player tuple to its soloq ids dictionary,
+                errors maps each player tuple that failed to the error message
+        """
+        players = list(dict.fromkeys(tuple(player) for player in players))
+        results, errors = {}, {}
+        max_workers = max_workers or self.max_workers
+        if max_workers > self.pool_maxsize:
+            with self.lock:
+                self.__mount(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(self.get_pro_soloq_ids, *player): player for player in players}
+            for future in as_completed(futures):
+                player = futures[future]
+                try:
+                    results[player] = future.result()
+                except Exception as e:
+                    errors[player] = str(e)
+        return results, errors
+
 
 if __name__ == "__main__":
     scraper = LeaguepediaScraper()
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from Metrics import metrics as default_metrics
+
+
+def parse_rate_limit(header_value: str) -> list:
+    """Parses a Riot rate limit header such as "20:1,100:120" into a list of (count, seconds) tuples
+
+    Args:
+        header_value (str): The value of an X-App-Rate-Limit or X-Method-Rate-Limit header
+
+    Returns:
+        list: A list of (max requests, window in seconds) tuples
+    """
+    limits = []
+    if not header_value:
+        return limits
+    for part in header_value.split(","):
+        count, seconds = part.strip().split(":")
+        limits.append((int(count), int(seconds)))
+    return limits
+
+
+class RateLimitBucket:
+    """A sliding window request budget for one rate limit (e.g. one token's app limit in one region)"""
+
+    def __init__(self, limits: list = None):
+        self.limits = []
+        self.windows = []
+        self.blocked_until = 0.0
+        self.set_limits(limits or [])
+
+    def set_limits(self, limits: list):
+        """Replaces the limits of the bucket, keeping the timestamps of the requests already sent"""
+        if limits == self.limits:
+            return
+        now = time.monotonic()
+        history = sorted(set(t for window in self.windows for t in window))
+        self.limits = list(limits)
+        self.windows = []
+        for count, seconds in self.limits:
+            window = deque(t for t in history if t > now - seconds)
+            self.windows.append(window)
+
+    def wait_time(self, now: float) -> float:
+        """Returns how many seconds to wait until one more request fits in every window of the bucket"""
+        wait = max(0.0, self.blocked_until - now)
+        for (count, seconds), window in zip(self.limits, self.windows):
+            while window and window[0] <= now - seconds:
+                window.popleft()
+            if len(window) >= count:
+                wait = max(wait, window[len(window) - count] + seconds - now)
+        return wait
+
+    def record(self, now: float):
+        """Records a request sent at the given time in every window of the bucket"""
+        for window in self.windows:
+            window.append(now)
+
+    def block(self, seconds: float):
+        """Blocks the bucket for the given amount of seconds, used when Riot answers with a 429"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RequestEngine:
+    """Sends requests to the Riot API across several tokens and regions at the highest rate the
+    app and method rate limits of each token allow.
+
+    Every (token, region) pair has its own app bucket and every (token, region, method) has its own method bucket.
+    Their limits are learned from the X-App-Rate-Limit and X-Method-Rate-Limit headers of the responses,
+    so each extra token adds throughput. Requests that are rate limited (429) or hit an unavailable server (503)
+    are retried in a loop without holding up the requests of other tokens.
+    """
+
+    # Limits of a development key, used until the first response tells us the real ones
+    default_app_limits = [(20, 1), (100, 120)]
+
+    def __init__(self, tokens: list, header: dict = None, max_workers: int = None, max_retries: int = 5,
+                 default_retry_after: float = 30, timeout: float = 30, metrics=None):
+        if isinstance(tokens, str):
+            tokens = [tokens]
+        if not tokens:
+            raise Exception("At least one token must be specified")
+        self.tokens = list(tokens)
+        self.header = dict(header or {})
+        self.max_workers = max_workers or min(32, 10 * len(self.tokens))
+        self.max_retries = max_retries
+        self.default_retry_after = default_retry_after
+        self.timeout = timeout
+        self.metrics = metrics or default_metrics
+
+        self.lock = threading.Lock()
+        self.app_buckets = {}
+        self.method_buckets = {}
+        self.next_token = 0
+        self.local = threading.local()
+        self.pool = None
+
+    def session(self) -> requests.Session:
+        """Returns the keep-alive session of the current thread"""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def __buckets(self, token: str, region: str, method: str):
+        app_key = (token, region)
+        if app_key not in self.app_buckets:
+            self.app_buckets[app_key] = RateLimitBucket(self.default_app_limits)
+        method_key = (token, region, method)
+        if method_key not in self.method_buckets:
+            self.method_buckets[method_key] = RateLimitBucket()
+        return self.app_buckets[app_key], self.method_buckets[method_key]
+
+    def __acquire(self, region: str, method: str) -> str:
+        """Waits until one of the tokens can send a request to the given region and method, and returns that token"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                shortest_wait = None
+                # Start from a different token every time so the load is spread evenly
+                for offset in range(len(self.tokens)):
+                    idx = (self.next_token + offset) % len(self.tokens)
+                    token = self.tokens[idx]
+                    app_bucket, method_bucket = self.__buckets(token, region, method)
+                    wait = max(app_bucket.wait_time(now), method_bucket.wait_time(now))
+                    if wait <= 0:
+                        app_bucket.record(now)
+                        method_bucket.record(now)
+                        self.next_token = (idx + 1) % len(self.tokens)
+                        return token
+                    if shortest_wait is None or wait < shortest_wait:
+                        shortest_wait = wait
+            time.sleep(shortest_wait)
+            self.metrics.count("riot_rate_limit_wait_seconds_total", shortest_wait, region=region, method=method)
+
+    def __update_limits(self, token: str, region: str, method: str, response: requests.Response):
+        with self.lock:
+            app_bucket, method_bucket = self.__buckets(token, region, method)
+            if "X-App-Rate-Limit" in response.headers:
+                app_bucket.set_limits(parse_rate_limit(response.headers["X-App-Rate-Limit"]))
+            if "X-Method-Rate-Limit" in response.headers:
+                method_bucket.set_limits(parse_rate_limit(response.headers["X-Method-Rate-Limit"]))
+        return app_bucket, method_bucket
+
+    def request(self, url: str, region: str, method: str) -> requests.Response:
+        """Sends a GET request to the Riot API, waiting for the rate limits and retrying 429 and 503 responses
+
+        Args:
+            url (str): The full URL to query
+            region (str): The region code the URL points to, e.g. na1. Rate limits are tracked per region
+            method (str): The name of the API method, e.g. summoner/v4/summoners/by-name. Rate limits are tracked per method
+
+        Returns:
+            requests.Response: The first response that is neither a 429 nor a 503,
+                or the last response if the retries ran out
+        """
+        attempt = 0
+        while True:
+            token = self.__acquire(region, method)
+            header = dict(self.header)
+            header["X-Riot-Token"] = token
+            start = time.perf_counter()
+            response = self.session().get(url, headers=header, timeout=self.timeout)
+            self.metrics.observe("riot_request_seconds", time.perf_counter() - start, region=region, method=method)
+            self.metrics.count("riot_requests_total", region=region, method=method, status=response.status_code)
+            app_bucket, method_bucket = self.__update_limits(token, region, method, response)
+
+            if response.status_code not in (429, 503) or attempt >= self.max_retries:
+                return response
+            attempt += 1
+            self.metrics.count("riot_retries_total", region=region, method=method, status=response.status_code)
+
+            if response.status_code == 429:
+                # If the request is rate limited, block the bucket that was exceeded for the specified time
+                # Check if response.headers["Retry-After"] exists, if not, wait for the default time
+                retry_after = float(response.headers.get("Retry-After", self.default_retry_after))
+                limit_type = response.headers.get("X-Rate-Limit-Type", "application")
+                self.metrics.event("rate_limited", "warning",
+                                   f"Rate limited ({limit_type}) on {region}, retrying in {retry_after} seconds",
+                                   region=region, method=method, limit_type=limit_type, retry_after=retry_after)
+                if limit_type in ("method", "application"):
+                    with self.lock:
+                        (method_bucket if limit_type == "method" else app_bucket).block(retry_after)
+                else:
+                    # The underlying service is limited for everyone, so only this request backs off
+                    time.sleep(retry_after)
+                    self.metrics.count("riot_rate_limit_wait_seconds_total", retry_after, region=region, method=method)
+            else:
+                # If the server is unavailable, back off exponentially and try again
+                backoff = min(self.default_retry_after, 2 ** attempt)
+                self.metrics.event("server_unavailable", "warning", f"Server unavailable, retrying in {backoff} seconds",
+                                   region=region, method=method, backoff=backoff)
+                time.sleep(backoff)
+                self.metrics.count("riot_backoff_seconds_total", backoff, region=region, method=method)
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the engine's thread pool and returns a Future"""
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self.pool.submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables) -> list:
+        """Runs fn over the iterables concurrently on the engine's thread pool and returns the results in order.
+        fn can send any number of requests through request(), the rate limits are shared by all of them.
+        """
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """Shuts down the thread pool"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,115 @@
+import json
+import sqlite3
+import threading
+import time
+
+from Metrics import metrics as default_metrics
+
+
+class ResponseCache:
+    """A persistent SQLite cache for JSON responses, keyed by region + endpoint + arguments.
+
+    Every entry belongs to a namespace (the first part of the API method, e.g. summoner or champion-mastery)
+    that decides how long it stays fresh. A TTL of None means the entry never expires and a TTL of 0 means
+    the namespace is not cached at all. When the cache holds more than max_entries,
+    the least recently used entries are evicted.
+    """
+
+    default_ttls = {
+        "summoner": 30 * 24 * 3600,         # puuids rarely change
+        "champion-mastery": 6 * 3600,       # mastery goes stale in hours
+        "league": 0,                        # leaderboards change all the time
+        "match": 0,                         # match ids change all the time, matches are kept in a MatchStore
+        "ddragon": None,                    # data for a version never changes
+    }
+
+    def __init__(self, path: str = "riot_cache.sqlite", ttls: dict = None, max_entries: int = 200000,
+                 default_ttl: float = 3600, metrics=None):
+        self.path = path
+        self.ttls = dict(self.default_ttls)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.metrics = metrics or default_metrics
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, namespace TEXT, value TEXT, created REAL, accessed REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.writes = 0
+
+    def ttl(self, namespace: str):
+        """Returns the TTL in seconds of a namespace, None if its entries never expire"""
+        return self.ttls.get(namespace, self.default_ttl)
+
+    def get(self, namespace: str, key: str):
+        """Returns the cached value of the key, or None if it is missing or stale
+
+        Args:
+            namespace (str): The namespace of the entry, used to look up its TTL
+            key (str): The key of the entry, e.g. na1/summoner/v4/summoners/by-name/Doublelift?page=1
+        """
+        ttl = self.ttl(namespace)
+        if ttl == 0:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.metrics.count("cache_lookups_total", namespace=namespace, result="miss")
+                return None
+            value, created = row
+            if ttl is not None and now - created > ttl:
+                self.metrics.count("cache_lookups_total", namespace=namespace, result="stale")
+                return None
+            self.metrics.count("cache_lookups_total", namespace=namespace, result="hit")
+            with self.connection:
+                self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value):
+        """Stores a JSON serializable value under the key, evicting the least recently used entries if the cache is full"""
+        if self.ttl(namespace) == 0:
+            return
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, namespace, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, namespace, json.dumps(value), now, now))
+            self.writes += 1
+            # Counting the rows on every write is wasteful, so only check the size every so often
+            if self.writes % 1000 == 0:
+                self.__evict()
+
+    def __evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self.metrics.count("cache_evictions_total", count - self.max_entries)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,))
+
+    def evict(self):
+        """Evicts the least recently used entries until the cache holds at most max_entries"""
+        with self.lock:
+            self.__evict()
+
+    def clear(self, namespace: str = None):
+        """Deletes every entry of the namespace, or the whole cache if no namespace is given"""
+        with self.lock, self.connection:
+            if namespace is None:
+                self.connection.execute("DELETE FROM responses")
+            else:
+                self.connection.execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
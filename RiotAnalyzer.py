@@ -1,7 +1,16 @@
-import requests
-import pandas as pd
+import csv
+import heapq
+import json
+import os
 import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# pandas is only imported by the methods that build DataFrames, so callers that only want the raw JSON
+# (and short-lived workers) don't pay for it
+from RequestEngine import RequestEngine
+from ResponseCache import ResponseCache
+from Metrics import metrics as default_metrics
 
 class RiotAnalyzer:
     """A class to get data from the Riot API
@@ -20,14 +29,33 @@ class RiotAnalyzer:
     tierDict = {'d': 'DIAMOND', 'e': 'EMERALD', 'p': 'PLATINUM', 'g': 'GOLD', 's': 'SILVER', 'b': 'BRONZE', 'i': 'IRON'}
     
     divisionDict = {"1": "I", "2": "II", "3": "III", "4": "IV"}
+    
+    # Platform -> regional routing value of the match-v5 API
+    routingDict = {'na1': 'americas', 'br1': 'americas', 'la1': 'americas', 'la2': 'americas',
+                   'euw1': 'europe', 'eun1': 'europe', 'tr1': 'europe', 'ru': 'europe',
+                   'kr': 'asia', 'jp1': 'asia',
+                   'oc1': 'sea', 'sg2': 'sea', 'ph2': 'sea', 'th2': 'sea', 'tw2': 'sea', 'vn2': 'sea'}
+    
+    ddragon_url_template = "http://ddragon.leagueoflegends.com/cdn/{version}/data/en_US/champion.json"
+    ddragon_versions_url = "http://ddragon.leagueoflegends.com/api/versions.json"
+    
+    # Local champion snapshots, one CSV per version in the same format as biden.csv (version, id, key, name, ...),
+    # with the tags stored as a JSON list. The snapshots bundled with the repo are read-only, new ones are saved
+    # under the snapshot_dir given to the constructor
+    bundled_snapshot_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "champion_data")
+    snapshot_template = "champion_{version}.csv"
 
 
-    def __init__(self, tokens:list, region="NA", version='13.17.1'):
+    def __init__(self, tokens:list, region="NA", version='13.17.1', max_workers:int=None,
+                 cache_path:str="riot_cache.sqlite", cache_ttls:dict=None, cache_max_entries:int=200000, use_cache:bool=True,
+                 metrics=None, snapshot_dir:str="champion_snapshots"):
         if region.upper() not in self.regionDict:
             raise Exception(f"Region {region} not found")
         region_code = self.regionDict[region.upper()]
         self.region_code = region_code
         
+        if isinstance(tokens, str):
+            tokens = [tokens]
         self.tokens = tokens
         self.token = tokens[0]
         self.version = version
@@ -40,11 +68,31 @@ class RiotAnalyzer:
             "X-Riot-Token": self.token
         }
         self.url_template = "https://{region_code}.api.riotgames.com/lol/{endpoint}?{query}"
-        self.champion_dict = None
-        self.champion_dict = self.get_champion_dict(version)
+        # Request counts, latencies, rate limit waits and cache hits are recorded here (see Metrics.py)
+        self.metrics = metrics or default_metrics
+        # All the Riot API requests go through the engine, which spreads them over every token
+        self.engine = RequestEngine(tokens, self.header, max_workers=max_workers, metrics=self.metrics)
+        # Responses are kept on disk so re-runs only spend rate limit budget on stale entries.
+        # Set use_cache to False to skip the cached values (fresh responses are still stored)
+        self.cache = ResponseCache(cache_path, ttls=cache_ttls, max_entries=cache_max_entries,
+                                   metrics=self.metrics) if cache_path else None
+        self.use_cache = use_cache
+        # Champion maps by version, loaded on first use so constructing the analyzer needs no network
+        self.champion_dicts = {}
+        self.snapshot_dir = snapshot_dir
+        
+    @property
+    def champion_dict(self):
+        """The champion map of self.version, loaded on first use"""
+        return self.get_champion_dict()
+    
+    @champion_dict.setter
+    def champion_dict(self, champion_dict):
+        self.champion_dicts[self.version] = champion_dict
         
     def swap_token(self):
-        """Swaps the current token with the next token in the tokens list
+        """Swaps the current token with the next token in the tokens list.
+        NOTE: Requests sent through the engine use every token already, this only changes self.header
         """
         current_idx = self.tokens.index(self.token)
         next_idx = (current_idx + 1) % len(self.tokens)
@@ -53,8 +101,87 @@ class RiotAnalyzer:
         return self.token
         
     
+    def snapshot_path(self, version:str) -> str:
+        """The path of the snapshot of a version, the bundled one if there is no saved one"""
+        filename = self.snapshot_template.format(version=version)
+        path = os.path.join(self.snapshot_dir, filename)
+        if self.bundled_snapshot_dir and not os.path.exists(path):
+            bundled_path = os.path.join(self.bundled_snapshot_dir, filename)
+            if os.path.exists(bundled_path):
+                return bundled_path
+        return path
+    
+    
+    def load_champion_snapshot(self, version:str):
+        """Loads the champion map of a version from its local snapshot
+
+        Returns:
+            dict: A dictionary of champion names and their IDs, or None if there is no snapshot for the version
+        """
+        path = self.snapshot_path(version)
+        if not os.path.exists(path):
+            return None
+        champion_dict = {}
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row["version"] == version:
+                    champion_dict[row["key"]] = row["name"]
+        return champion_dict or None
+    
+    
+    def save_champion_snapshot(self, version:str, data:dict):
+        """Saves the champion.json data of a version as a local snapshot, so later runs can start offline"""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = os.path.join(self.snapshot_dir, self.snapshot_template.format(version=version))
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["version", "id", "key", "name", "tags"])
+            for champion in data["data"].values():
+                writer.writerow([version, champion["id"], champion["key"], champion["name"],
+                                 json.dumps(champion.get("tags", []))])
+    
+    
+    def get_champion_data(self, version=None):
+        """Gets the champion.json data of a version from the response cache or Data Dragon,
+        and saves the champion snapshot of the version
+
+        Args:
+            version (str): The version of the game to get the champion data for
+
+        Returns:
+            dict: The champion.json response
+        """
+        if not version:
+            version = self.version
+        # The champion data of a version never changes, so it is only downloaded once
+        key = f"ddragon/{version}/data/en_US/champion.json"
+        data = self.cache.get("ddragon", key) if self.cache and self.use_cache else None
+        if data is None:
+            import requests
+            url = self.ddragon_url_template.format(version=version)
+            response = requests.get(url)
+            if response.status_code != 200:
+                raise Exception(f"Error {response.status_code} when querying champion data")
+            data = response.json()
+            if self.cache:
+                self.cache.set("ddragon", key, data)
+        if not os.path.exists(self.snapshot_path(version)):
+            self.save_champion_snapshot(version, data)
+        return data
+    
+    
+    def get_versions(self) -> list:
+        """Gets every version of the game from Data Dragon, newest first"""
+        import requests
+        response = requests.get(self.ddragon_versions_url)
+        if response.status_code != 200:
+            raise Exception(f"Error {response.status_code} when querying versions")
+        return response.json()
+    
+    
     def get_champion_dict(self, version=None):
-        """Gets a dictionary of champion names and their IDs
+        """Gets a dictionary of champion names and their IDs. It is looked up in order in the champion maps
+        already loaded, the local snapshot of the version, the response cache and finally Data Dragon.
 
         Args:
             version (str): The version of the game to get the champion data for
@@ -64,17 +191,16 @@ class RiotAnalyzer:
         """
         if not version:
             version = self.version
-        elif self.champion_dict and version == self.version:
-            return self.champion_dict
-        url = f"http://ddragon.leagueoflegends.com/cdn/{version}/data/en_US/champion.json"
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise Exception(f"Error {response.status_code} when querying champion data")
-        data = response.json()
-        champion_dict = {}
-        for champion in data["data"]:
-            champion_dict[data["data"][champion]["key"]] = data["data"][champion]["name"]
-        self.champion_dict = champion_dict
+        if version in self.champion_dicts:
+            return self.champion_dicts[version]
+        
+        champion_dict = self.load_champion_snapshot(version)
+        if champion_dict is None:
+            data = self.get_champion_data(version)
+            champion_dict = {}
+            for champion in data["data"]:
+                champion_dict[data["data"][champion]["key"]] = data["data"][champion]["name"]
+        self.champion_dicts[version] = champion_dict
         return champion_dict
     
     
@@ -82,6 +208,51 @@ class RiotAnalyzer:
         return self.champion_dict[str(champion_code)]
     
     
+    def request_json(self, region_code:str, endpoint:str, query:str, method:str, error_message:str, use_cache:bool=None):
+        """Sends a request to the Riot API through the engine and returns the JSON response.
+        Fresh responses from the cache are returned without sending a request.
+
+        Args:
+            region_code (str): The region code to query, e.g. na1
+            endpoint (str): The endpoint to query, e.g. summoner/v4/summoners/by-name/{name}
+            query (str): The query string of the URL
+            method (str): The API method the endpoint belongs to, used to track its rate limit
+            error_message (str): The message of the exception raised if the response is not a 200
+            use_cache (bool, optional): Whether to return the cached response if it is fresh. Defaults to self.use_cache.
+
+        Returns:
+            json: The JSON response from the Riot API
+        """
+        if use_cache is None:
+            use_cache = self.use_cache
+        # The cache TTL is chosen by the API family, e.g. summoner or champion-mastery
+        namespace = method.split("/")[0]
+        key = f"{region_code}/{endpoint}?{query}"
+        if self.cache and use_cache:
+            data = self.cache.get(namespace, key)
+            if data is not None:
+                return data
+        
+        url = self.url_template.format(region_code=region_code, endpoint=endpoint, query=query)
+        response = self.engine.request(url, region_code, method)
+        if response.status_code != 200:
+            raise Exception(error_message.format(status_code=response.status_code))
+        data = response.json()
+        if self.cache:
+            self.cache.set(namespace, key, data)
+        return data
+    
+    
+    def map(self, fn, *iterables) -> list:
+        """Runs fn over the iterables concurrently, e.g. ra.map(ra.get_mastery_by_summoner_name, names, regions).
+        All the requests sent by fn share the rate limits of every token, so each extra token adds throughput.
+
+        Returns:
+            list: The results of fn, in the same order as the iterables
+        """
+        return self.engine.map(fn, *iterables)
+    
+    
     def get_leaderboard_raw(self, queue, rank:str, region=None, page=1):
         """Gets a certain page of the leaderboard for a specific queue, tier, and division. NOTE: It is not sorted.
         Returns the JSON response from the Riot API.
@@ -90,7 +261,7 @@ class RiotAnalyzer:
             queue (str): The queue type to query for. Can be RANKED_SOLO_5x5, RANKED_FLEX_SR, RANKED_FLEX_TT
             tier (str): The tier to query for. Can be DIAMOND, EMERALD, PLATINUM, GOLD, SILVER, BRONZE, IRON
             division (str): The division to query for. Can be I, II, III, IV
-            region (str, optional): The region to search the leaderboard for. Defaults to the region specified in the constructor.
+            region (str, optional): The region to search the leaderboard for, e.g. NA or na1. Defaults to the region specified in the constructor.
         """
         queue = queue.lower()
         if queue not in self.queueDict:
@@ -113,125 +284,214 @@ class RiotAnalyzer:
         
         if region is None:
             region = self.region_code
-        elif region.upper() not in self.regionDict:
+        elif region.upper() in self.regionDict:
+            region = self.regionDict[region.upper()]
+        elif region.lower() not in self.regionDict.values():
             raise Exception(f"Region {region} not found")
                 
         endpoint = f"league/v4/entries/{queue}/{tier}/{division}"
         
-        url = self.url_template.format(region_code=self.region_code, endpoint=endpoint, query=f"page={page}")
-        response = requests.get(url, headers=self.header)
-        
-        if response.status_code == 429:
-            # If the request is rate limited, wait for the specified time and try again
-            # Check if response.headers["Retry-After"] exists, if not, wait for 10 seconds
-            if "Retry-After" not in response.headers:
-                print("Rate limited, retrying in 30 seconds")
-                time.sleep(30)
-                return self.get_leaderboard_raw(queue, rank, region, page)
-            else:
-                retry_after = response.headers["Retry-After"]
-                print(f"Rate limited, retrying in {retry_after} seconds")
-                time.sleep(retry_after)
-                return self.get_leaderboard_raw(queue, rank, region, page)
-            
-        elif response.status_code == 503:
-            # If the server is unavailable, wait for 30 seconds and try again
-            print("Server unavailable, retrying in 30 seconds")
-            time.sleep(30)
-            return self.get_leaderboard_raw(queue, rank, region, page)
-        
-        elif response.status_code != 200:
-            raise Exception(
-                f"Error {response.status_code} when querying leaderboard")
-        data = response.json()
+        # Rate limits (429) and unavailable servers (503) are retried by the engine
+        data = self.request_json(region.lower(), endpoint, f"page={page}", "league/v4/entries",
+                                 "Error {status_code} when querying leaderboard")
 
         return data
 
 
-    def get_top(self, queue=None, rank=None, region="NA", n:int=20, start_page:int=1, page_limit:int=99999):
+    def get_top(self, queue=None, rank=None, region=None, n:int=20, start_page:int=1, page_limit:int=99999, prefetch:int=4):
         """Takes in the JSON data from get_leaderboard_raw and converts it to a Pandas DataFrame containing the following columns in order:
         tier, division, rank, summonerId, summonerName, leaguePoints, wins, losses, veteran, inactive, freshBlood, queueType
 
         Args:
             data (json bytearray): The JSON data from get_leaderboard_raw
+            region (str, optional): The region of the leaderboard, e.g. NA or na1. Defaults to the region specified in the constructor.
+            prefetch (int, optional): How many pages are fetched concurrently ahead of the one being processed. Defaults to 4.
         """
-        # Use a while loop to get all the pages of the leaderboard
-        # For each page, take only the top 20 highest "leaguePoint" and discard the rest
-        # On each subsequent iteration, also take the top 20, append that to the DataFrame, and again keep only the top 20
-        # So each iteration will add 20 rows to the DataFrame, but then discard all but the top 20 rows among the 40 rows, by leaguePoints
+        # Go through all the pages of the leaderboard, streaming every entry through a heap that only keeps the top n
+        # by leaguePoints, then winrate. The DataFrame is built once at the end from the kept entries.
         # This is done because the Riot API only returns 200 entries per page, and there are more than 200 entries in the leaderboard
         # So we have to get all the pages and then sort them ourselves
         if queue is None:
             raise Exception("Queue must be specified")
         if rank is None:
             raise Exception("Rank must be specified")
+        region = region or self.region_code
         
-        page = start_page
+        last_page = page_limit + start_page - 1
         total_entries = 0
-        result_df = pd.DataFrame()
-        print("Queried pages: ", end="")
-        while True and (page <= page_limit + start_page - 1):
-            print(page, end=", ")
-            # Add line break every 10 pages
-            if page % 10 == 0:
-                print()
-            data = self.get_leaderboard_raw(queue, rank, region, page)
-            # Exit the loop if there is no more data
-            if data == []:
-                break
-            df = pd.DataFrame(data)
-            
-            # Add a new "Winrate" column to the DataFrame
-            df["winrate"] = df["wins"] / (df["wins"] + df["losses"])
-           
-            # Add the total number of entries in the leaderboard to the total_entries variable
-            total_entries += len(df)
-            
-            # Concatenate the new DataFrame to the result DataFrame
-            result_df = pd.concat([result_df, df])
-            
-            # Sort the result DataFrame by leaguePoints, then winrate
-            result_df = result_df.sort_values(by=["leaguePoints", "winrate"], ascending=False)
-           
-            # Keep only the top x amount rows (default 20)
-            result_df = result_df.head(n)
-            page += 1
-        
-        # Reset the index of the result DataFrame, drop the old index,
-        # and rename the new index to "Rank"
-        result_df = result_df.reset_index(drop=True)
+        # Min-heap of the n best entries so far, keyed by (leaguePoints, winrate, -position),
+        # so the worst of the kept entries is always heap[0] and ties keep the order they were queried in
+        heap = []
+        position = 0
+        # Every column seen on any page, in order of appearance, like pd.concat would produce
+        columns = {}
+        # The first entry, which gives the column dtypes of an empty result
+        first_entry = None
+        
+        # Fetch the next few pages concurrently while the current one is being processed
+        pool = ThreadPoolExecutor(max_workers=max(1, prefetch))
+        pending = deque()
+        next_page = start_page
+        pages = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                while len(pending) < max(1, prefetch) and next_page <= last_page:
+                    pending.append((next_page, pool.submit(self.get_leaderboard_raw, queue, rank, region, next_page)))
+                    next_page += 1
+                if not pending:
+                    break
+                page, future = pending.popleft()
+                data = future.result()
+                pages += 1
+                self.metrics.event("leaderboard_page", "debug", queue=queue, rank=rank, region=region,
+                                   page=page, entries=len(data))
+                # Exit the loop if there is no more data
+                if data == []:
+                    break
+                
+                # Add the total number of entries in the leaderboard to the total_entries variable
+                total_entries += len(data)
+                
+                for entry in data:
+                    if first_entry is None:
+                        first_entry = entry
+                    for column in entry:
+                        columns.setdefault(column, None)
+                    games = entry["wins"] + entry["losses"]
+                    # Add a new "Winrate" value to the entry
+                    winrate = entry["wins"] / games if games else float("nan")
+                    key = (entry["leaguePoints"], winrate if games else float("-inf"), -position, {**entry, "winrate": winrate})
+                    position += 1
+                    # Keep only the top x amount entries (default 20)
+                    if len(heap) < n:
+                        heapq.heappush(heap, key)
+                    elif n > 0 and key[:3] > heap[0][:3]:
+                        heapq.heapreplace(heap, key)
+                # winrate follows the columns of the first page, a column first seen on a later page goes after it
+                columns.setdefault("winrate", None)
+        finally:
+            # Drop the prefetched pages past the end of the leaderboard
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+        
+        import pandas as pd
+        
+        # Sort the kept entries by leaguePoints, then winrate
+        rows = [key[3] for key in sorted(heap, key=lambda key: key[:3], reverse=True)]
+        with self.metrics.timer("dataframe_build_seconds", function="get_top"):
+            if rows:
+                result_df = pd.DataFrame(rows, columns=list(columns))
+            elif first_entry is not None:
+                # n=0 keeps no entries, but the result still has the columns of the leaderboard
+                result_df = pd.DataFrame([first_entry], columns=list(columns)).iloc[:0]
+            else:
+                result_df = pd.DataFrame()
+        
+        # Rename the index to "Rank", starting from 1
         result_df.index.name = "Rank"
         result_df.index += 1
-        print("Total entries:", total_entries)
+        self.metrics.event("leaderboard_scanned", "info", f"Total entries: {total_entries}", queue=queue, rank=rank,
+                           region=region, pages=pages, entries=total_entries,
+                           seconds=time.perf_counter() - start)
     
         return result_df
 
-    def get_puuid(self, name:str, region_code:str="NA"):
+    def get_summoner(self, name:str, region_code:str="NA", use_cache:bool=None):
+        """Gets the summoner data (id, puuid, name, ...) of a summoner name"""
         if region_code in self.regionDict.keys():
             region_code = self.regionDict[region_code]
-        url = self.url_template.format(region_code=region_code, endpoint="summoner/v4/summoners/by-name/"+name, query="page=1")
-
-        response = requests.get(url, headers=self.header)
-        if response.status_code != 200:
-            raise Exception("Error with response code: {}".format(response.status_code))
-        else:
-            name_data = response.json()
-            puuid = name_data["puuid"]
-            return puuid
+        return self.request_json(region_code, "summoner/v4/summoners/by-name/"+name, "page=1",
+                                 "summoner/v4/summoners/by-name", "Error with response code: {status_code}",
+                                 use_cache=use_cache)
     
-    def get_mastery(self, puuid:str, region_code:str="NA"):
+    def get_summoner_by_puuid(self, puuid:str, region_code:str="NA", use_cache:bool=None):
+        """Gets the summoner data of a puuid, e.g. to find its current name"""
         if region_code in self.regionDict.keys():
             region_code = self.regionDict[region_code]
-        url = self.url_template.format(region_code=region_code, endpoint=f"champion-mastery/v4/champion-masteries/by-puuid/{puuid}", query="page=1")
-        
-        response = requests.get(url, headers=self.header)
-        if response.status_code != 200:
-            raise Exception(f"Error {response.status_code} when querying mastery")
-        else:
-            return response.json()
+        return self.request_json(region_code, f"summoner/v4/summoners/by-puuid/{puuid}", "page=1",
+                                 "summoner/v4/summoners/by-puuid", "Error {status_code} when querying summoner",
+                                 use_cache=use_cache)
     
-    def get_mastery_by_summoner_name(self, name, region_code:str="NA"):
+    def get_puuid(self, name:str, region_code:str="NA"):
+        puuid = self.get_summoner(name, region_code)["puuid"]
+        return puuid
+    
+    def get_mastery(self, puuid:str, region_code:str="NA", use_cache:bool=None):
+        if region_code in self.regionDict.keys():
+            region_code = self.regionDict[region_code]
+        return self.request_json(region_code, f"champion-mastery/v4/champion-masteries/by-puuid/{puuid}", "page=1",
+                                 "champion-mastery/v4/champion-masteries/by-puuid",
+                                 "Error {status_code} when querying mastery", use_cache=use_cache)
+    
+    def build_mastery_frame(self, responses:dict, version:str=None):
+        """Builds one long DataFrame from the raw mastery responses of many accounts at once.
+        The columns are filled straight from the JSON lists, so the cost is one pass over the responses
+        instead of one pandas call per row.
 
+        Args:
+            responses (dict): The get_mastery responses, keyed by account, e.g. {("NA", "Doublelift"): [...]}.
+                The keys go in the account column, and can be any hashable
+            version (str, optional): The version of the champion names. Defaults to self.version.
+
+        Returns:
+            pd.DataFrame: One row per account and champion, in the order of the responses, with the columns
+                account, championId (int16), championName (category), championLevel (int8), championPoints (int32),
+                lastPlayDate (local datetime), share (championPoints / total points of the account, 0 to 1)
+                and percent (share in percent)
+        """
+        import numpy as np
+        import pandas as pd
+
+        champion_dict = self.get_champion_dict(version)
+        accounts = list(responses.keys())
+        lengths = np.fromiter((len(responses[account]) for account in accounts), dtype=np.int64, count=len(accounts))
+        mastery = [m for account in accounts for m in responses[account]]
+        count = len(mastery)
+
+        champion_ids = np.fromiter((m["championId"] for m in mastery), dtype=np.int16, count=count)
+        points = np.fromiter((m["championPoints"] for m in mastery), dtype=np.int32, count=count)
+        levels = np.fromiter((m["championLevel"] for m in mastery), dtype=np.int8, count=count)
+        last_play = np.fromiter((m["lastPlayTime"] for m in mastery), dtype=np.int64, count=count)
+
+        # Champion ids index straight into the codes of the champion names, ids missing from the map become NaN
+        keys = np.array([int(key) for key in champion_dict], dtype=np.int64)
+        names = list(champion_dict.values())
+        size = max(int(keys.max(initial=0)), int(champion_ids.max(initial=0))) + 1
+        lookup = np.full(size, -1, dtype=np.int32)
+        lookup[keys] = np.arange(len(keys))
+        champion_names = pd.Categorical.from_codes(lookup[champion_ids], categories=names)
+
+        # The responses of an account are contiguous, so the totals are sums over segments
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        non_empty = lengths > 0
+        totals = np.zeros(len(accounts), dtype=np.int64)
+        totals[non_empty] = np.add.reduceat(points.astype(np.int64), starts[non_empty])
+        row_totals = np.repeat(totals, lengths)
+        share = np.divide(points, row_totals, out=np.zeros(count), where=row_totals > 0)
+
+        account_codes = np.repeat(np.arange(len(accounts)), lengths)
+        # Same local time as datetime.fromtimestamp. The UTC offset is looked up once per quarter hour
+        # (time zones only change offset on those boundaries) instead of once per row
+        quarters, inverse = np.unique(last_play // 900000, return_inverse=True)
+        offsets = np.fromiter((time.localtime(quarter * 900).tm_gmtoff for quarter in quarters.tolist()),
+                              dtype=np.int64, count=len(quarters))
+        last_play_date = pd.to_datetime(last_play + 1000 * offsets[inverse.reshape(-1)], unit="ms")
+
+        return pd.DataFrame({
+            "account": pd.Categorical.from_codes(account_codes, categories=pd.Index(accounts, tupleize_cols=False)),
+            "championId": champion_ids,
+            "championName": champion_names,
+            "championLevel": levels,
+            "championPoints": points,
+            "lastPlayDate": last_play_date,
+            "share": share,
+            "percent": 100 * share,
+        })
+    
+    
+    def get_mastery_by_summoner_name(self, name, region_code:str="NA"):
         if region_code in self.regionDict.keys():
             region_code = self.regionDict[region_code]
         elif region_code not in self.regionDict.values():
@@ -239,16 +499,169 @@ class RiotAnalyzer:
         
         puuid = self.get_puuid(name, region_code)
         mastery = self.get_mastery(puuid,region_code)
-        df = pd.DataFrame(mastery)
-        
-        df["championName"] = df["championId"].apply(lambda x: self.get_champion_dict()[str(x)])
-        df = df[["championName", "championLevel", "championPoints", "lastPlayTime"]]
-        df["lastPlayDate"] = df["lastPlayTime"].apply(lambda x: datetime.fromtimestamp(x/1000))
-        df["lastPlayTime"] = df["lastPlayTime"].apply(lambda x: datetime.fromtimestamp(x/1000).strftime("%b %d %H:%M"))
-        df["percent"] = df["championPoints"]/df["championPoints"].sum()
-        df["percent"] = df["percent"].apply(lambda x: "{:.2%}".format(x))
-        df.index += 1
-        df.index.name = "Rank"
+        with self.metrics.timer("dataframe_build_seconds", function="get_mastery_by_summoner_name"):
+            df = self.build_mastery_frame({(region_code, name): mastery})
+            df = df[["championName", "championLevel", "championPoints", "lastPlayDate", "percent"]]
+            df.insert(3, "lastPlayTime", df["lastPlayDate"].dt.strftime("%b %d %H:%M"))
+            df.index += 1
+            df.index.name = "Rank"
         return df
 
     
+    def get_routing(self, region_code:str="NA") -> str:
+        """Gets the regional routing value (americas, europe, asia or sea) that serves the match-v5 API of a region"""
+        if region_code in self.regionDict.keys():
+            region_code = self.regionDict[region_code]
+        if region_code.lower() not in self.routingDict:
+            raise Exception(f"Region {region_code} not found")
+        return self.routingDict[region_code.lower()]
+    
+    
+    def get_match_ids(self, puuid:str, region_code:str="NA", start_time:int=None, queue:int=420, start:int=0, count:int=100,
+                      end_time:int=None):
+        """Gets one page of the match ids of a player, newest first
+
+        Args:
+            puuid (str): The puuid of the player
+            region_code (str, optional): The region of the player. Defaults to "NA".
+            start_time (int, optional): Only games played after this epoch timestamp, in seconds. Defaults to None.
+            queue (int, optional): The queue id, e.g. 420 for ranked solo. None for every queue. Defaults to 420.
+            start (int, optional): The index of the first match id. Defaults to 0.
+            count (int, optional): The number of match ids, at most 100. Defaults to 100.
+            end_time (int, optional): Only games played before this epoch timestamp, in seconds. Defaults to None.
+        """
+        query = f"start={start}&count={count}"
+        if start_time is not None:
+            query += f"&startTime={int(start_time)}"
+        if end_time is not None:
+            query += f"&endTime={int(end_time)}"
+        if queue is not None:
+            query += f"&queue={queue}"
+        return self.request_json(self.get_routing(region_code), f"match/v5/matches/by-puuid/{puuid}/ids", query,
+                                 "match/v5/matches/by-puuid/ids", "Error {status_code} when querying match ids")
+    
+    
+    def get_new_match_ids(self, puuid:str, region_code:str="NA", start_time:int=None, queue:int=420, max_matches:int=None,
+                          end_time:int=None) -> list:
+        """Pages through the match ids of a player played after start_time (and before end_time),
+        until a short page or max_matches ids"""
+        match_ids = []
+        while max_matches is None or len(match_ids) < max_matches:
+            count = 100 if max_matches is None else min(100, max_matches - len(match_ids))
+            page = self.get_match_ids(puuid, region_code, start_time, queue, len(match_ids), count, end_time)
+            match_ids.extend(page)
+            if len(page) < count:
+                break
+        return match_ids
+    
+    
+    def get_match(self, match_id:str):
+        """Gets a match-v5 response. The region is read from the match id, e.g. NA1_4766349035"""
+        routing = self.get_routing(match_id.split("_")[0])
+        return self.request_json(routing, f"match/v5/matches/{match_id}", "", "match/v5/matches",
+                                 "Error {status_code} when querying match " + match_id)
+    
+    
+    def ingest_matches(self, accounts, store, queue:int=420, start_time:int=None, max_matches:int=None,
+                       sync_margin:int=7200) -> dict:
+        """Syncs the match history of many players into a MatchStore.
+        Only the games played since the last sync of each player are paged, and every match is fetched once,
+        even if several of the players played in it or it is already in the store.
+        The matches are written to the store as soon as they arrive.
+        A player is only marked as synced once its match ids were paged to the end and all of its new matches are stored.
+        It is marked as synced until the start of its newest stored game, or sync_margin seconds before the sync started
+        if that is later, so a game that was still being played during the sync is paged by the next one.
+        A player stopped by max_matches keeps a cursor at its oldest paged game instead: the next syncs carry on
+        with the older games, until they are all stored, and only then page the games played since.
+
+        Args:
+            accounts (dict or list): {puuid: region} or a list of (puuid, region) tuples
+            store (MatchStore): Where the matches are stored
+            queue (int, optional): The queue id to ingest, None for every queue. Defaults to 420, ranked solo.
+            start_time (int, optional): Epoch seconds of the oldest games of players that were never synced. Defaults to None.
+            max_matches (int, optional): The maximum number of new match ids paged per player. Players with more new
+                games are not marked as synced, their older games are paged by the next syncs. Defaults to None.
+            sync_margin (int, optional): Seconds, at least the length of a game. Defaults to 7200.
+
+        Returns:
+            dict: Counts of the players, match ids paged, matches fetched, shared with another player or already stored,
+                players left incomplete by max_matches, and errors mapping each failed puuid or match id to its error message
+        """
+        accounts = dict(accounts)
+        errors = {}
+        started = int(time.time())
+        
+        pages = {}
+        cursors = {}
+        for puuid, region in accounts.items():
+            since = store.synced_until(puuid)
+            cursors[puuid] = store.cursor(puuid)
+            end_time = cursors[puuid][0] if cursors[puuid] else None
+            pages[self.engine.submit(self.get_new_match_ids, puuid, region,
+                                     start_time if since is None else since, queue, max_matches, end_time)] = puuid
+        
+        def fetch(match_id):
+            store.add_match(self.get_match(match_id))
+        
+        # match id -> Future of its fetch, shared by every player that played in the match
+        fetches = {}
+        seen = set()
+        player_matches = {}
+        paged = shared = known = 0
+        for future in as_completed(pages):
+            puuid = pages[future]
+            try:
+                match_ids = future.result()
+            except Exception as e:
+                errors[puuid] = str(e)
+                continue
+            player_matches[puuid] = match_ids
+            paged += len(match_ids)
+            new_ids = [match_id for match_id in match_ids if match_id not in seen]
+            shared += len(match_ids) - len(new_ids)
+            seen.update(new_ids)
+            stored = store.known_matches(new_ids)
+            known += len(stored)
+            for match_id in new_ids:
+                if match_id not in stored:
+                    fetches[match_id] = self.engine.submit(fetch, match_id)
+        
+        failed = set()
+        for match_id, future in fetches.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[match_id] = str(e)
+                failed.add(match_id)
+        
+        # A player is only marked as synced if all of its new matches were paged and stored, otherwise the next sync pages them again
+        incomplete = 0
+        for puuid, match_ids in player_matches.items():
+            if cursors[puuid]:
+                # The games after the cursor were stored by an earlier sync, which already chose the synced_until
+                synced_until = cursors[puuid][1]
+            else:
+                bounds = [started - sync_margin, store.synced_until(puuid), store.last_game_start(puuid)]
+                synced_until = max(bound for bound in bounds if bound is not None)
+            if not failed.isdisjoint(match_ids):
+                errors[puuid] = "Some matches could not be fetched"
+            elif max_matches is not None and len(match_ids) >= max_matches:
+                # The paging stopped at max_matches, the next sync carries on before the oldest game paged
+                incomplete += 1
+                oldest = store.oldest_game_start(match_ids)
+                if oldest is not None:
+                    store.set_cursor(puuid, accounts[puuid], oldest - 1, synced_until)
+            else:
+                store.set_synced(puuid, accounts[puuid], synced_until)
+        
+        self.metrics.count("match_ids_total", shared, result="shared")
+        self.metrics.count("match_ids_total", known, result="stored")
+        self.metrics.count("match_ids_total", len(fetches), result="fetched")
+        self.metrics.event("matches_ingested", "info",
+                           f"Fetched {len(fetches) - len(failed)} matches for {len(player_matches)} players "
+                           f"({shared} shared, {known} already stored)",
+                           players=len(player_matches), paged=paged, fetched=len(fetches) - len(failed),
+                           shared=shared, stored=known, incomplete=incomplete, errors=len(errors))
+        return {"players": len(player_matches), "paged": paged, "fetched": len(fetches) - len(failed),
+                "shared": shared, "stored": known, "incomplete": incomplete, "errors": errors}
+    
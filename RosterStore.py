@@ -0,0 +1,156 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from MasteryPipeline import account_keys, roster_account_lists
+
+
+class RosterStore:
+    """Stores the roster and mastery data as typed Parquet tables instead of CSVs with stringified dicts.
+
+    Three tables are kept under root:
+        pros: one row per pro (pro_id, Region, Team, Official Summoner Name, Roles (LeaguePedia), Roles (RCD))
+        accounts: one row per pro/region/summoner name (pro_id, region, summoner_name, puuid), partitioned by region
+        mastery: one row per account and champion (pro_id, region, summoner_name, puuid, championId,
+            championPoints, championLevel, lastPlayTime), partitioned by region
+
+    The partitioned tables can be loaded for a few regions only, and every table for a few columns only.
+    Requires pyarrow.
+    """
+
+    pro_columns = ["Region", "Team", "Official Summoner Name", "Roles (LeaguePedia)", "Roles (RCD)"]
+
+    def __init__(self, root: str = "data"):
+        self.root = root
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.root, table)
+
+    def __save(self, df: pd.DataFrame, table: str, partitioned: bool):
+        path = self.path(table)
+        # The tables are always written in full, so the old files must go
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        os.makedirs(self.root, exist_ok=True)
+        if partitioned:
+            df.to_parquet(path, index=False, partition_cols=["region"])
+        else:
+            df.to_parquet(path, index=False)
+
+    def __load(self, table: str, columns: list = None, regions: list = None) -> pd.DataFrame:
+        filters = [("region", "in", list(regions))] if regions is not None else None
+        df = pd.read_parquet(self.path(table), columns=columns, filters=filters)
+        if "region" in df.columns:
+            # The partition column comes back as a categorical of every partition, keep only the loaded ones
+            df["region"] = df["region"].astype(str).astype("category")
+        return df
+
+    def save_pros(self, pros: pd.DataFrame):
+        self.__save(pros, "pros", partitioned=False)
+
+    def load_pros(self, columns: list = None) -> pd.DataFrame:
+        if columns is not None and "pro_id" not in columns:
+            columns = ["pro_id"] + list(columns)
+        return self.__load("pros", columns).set_index("pro_id")
+
+    def save_accounts(self, accounts: pd.DataFrame):
+        self.__save(accounts, "accounts", partitioned=True)
+
+    def load_accounts(self, columns: list = None, regions: list = None) -> pd.DataFrame:
+        return self.__load("accounts", columns, regions)
+
+    def save_mastery(self, mastery: pd.DataFrame):
+        self.__save(mastery, "mastery", partitioned=True)
+
+    def load_mastery(self, columns: list = None, regions: list = None) -> pd.DataFrame:
+        return self.__load("mastery", columns, regions)
+
+    def load_roster(self) -> pd.DataFrame:
+        """Loads the pros with their Account_list column rebuilt from the accounts table,
+        ready to be passed to MasteryPipeline.run
+
+        Returns:
+            pd.DataFrame: The pro dataframe indexed by pro_id
+        """
+        pros = self.load_pros()
+        accounts = self.load_accounts(columns=["pro_id", "region", "summoner_name"])
+        account_lists = {pro_id: {} for pro_id in pros.index}
+        for pro_id, region, name in zip(accounts["pro_id"], accounts["region"], accounts["summoner_name"]):
+            account_lists[pro_id].setdefault(region + ":", []).append(name)
+        pros["Account_list"] = [account_lists[pro_id] for pro_id in pros.index]
+        return pros
+
+
+def roster_tables(roster_df: pd.DataFrame) -> tuple:
+    """Splits the pro dataframe (e.g. pro_df.csv or pro_mastery.csv) into the pros and accounts tables.
+    The ids or Account_list strings are parsed once here instead of on every load.
+
+    Args:
+        roster_df (pd.DataFrame): The pro dataframe, with either an Account_list or an ids column
+
+    Returns:
+        tuple: (pros, accounts) dataframes
+    """
+    pros = roster_df[[c for c in RosterStore.pro_columns if c in roster_df.columns]].copy()
+    pros.insert(0, "pro_id", np.arange(len(pros), dtype=np.int32))
+    for column in ["Region", "Roles (LeaguePedia)", "Roles (RCD)"]:
+        if column in pros.columns:
+            pros[column] = pros[column].astype("category")
+    pros = pros.reset_index(drop=True)
+
+    rows = [(pro_id, region, name) for pro_id, account_list in zip(pros["pro_id"], roster_account_lists(roster_df))
+            for region, name in account_keys(account_list)]
+    accounts = pd.DataFrame(rows, columns=["pro_id", "region", "summoner_name"])
+    accounts["pro_id"] = accounts["pro_id"].astype(np.int32)
+    accounts["puuid"] = pd.Series(None, index=accounts.index, dtype="string")
+    return pros, accounts
+
+
+def mastery_table(accounts: pd.DataFrame, results: dict) -> pd.DataFrame:
+    """Builds the long format mastery table from the results of MasteryPipeline.run
+
+    Args:
+        accounts (pd.DataFrame): The accounts table, from roster_tables or RosterStore.load_accounts
+        results (dict): The (region, name) -> checkpoint record results of the pipeline
+
+    Returns:
+        pd.DataFrame: One row per account and champion. An account listed under several pros appears once per pro
+    """
+    pro_ids, regions, names, puuids = [], [], [], []
+    champion_ids, points, levels, last_play = [], [], [], []
+    for pro_id, region, name in zip(accounts["pro_id"], accounts["region"], accounts["summoner_name"]):
+        record = results.get((region, name))
+        if record is None:
+            continue
+        mastery = record["mastery"]
+        pro_ids += [pro_id] * len(mastery)
+        regions += [region] * len(mastery)
+        names += [name] * len(mastery)
+        puuids += [record["puuid"]] * len(mastery)
+        for m in mastery:
+            champion_ids.append(m["championId"])
+            points.append(m["championPoints"])
+            levels.append(m["championLevel"])
+            last_play.append(m["lastPlayTime"])
+    return pd.DataFrame({
+        "pro_id": np.array(pro_ids, dtype=np.int32),
+        "region": pd.Categorical(regions),
+        "summoner_name": pd.array(names, dtype="string"),
+        "puuid": pd.array(puuids, dtype="string"),
+        "championId": np.array(champion_ids, dtype=np.int16),
+        "championPoints": np.array(points, dtype=np.int32),
+        "championLevel": np.array(levels, dtype=np.int8),
+        "lastPlayTime": pd.to_datetime(np.array(last_play, dtype=np.int64), unit="ms"),
+    })
+
+
+def update_puuids(accounts: pd.DataFrame, results: dict) -> pd.DataFrame:
+    """Fills the puuid column of the accounts table from the results of MasteryPipeline.run"""
+    accounts = accounts.copy()
+    accounts["puuid"] = pd.array([results.get((r, n), {}).get("puuid") for r, n in
+                                  zip(accounts["region"], accounts["summoner_name"])], dtype="string")
+    return accounts
@@ -0,0 +1,414 @@
+"""Offline benchmarks for the Riot API, Data Dragon and Leaguepedia code paths.
+
+Starts a local stand-in HTTP server that serves recorded or synthetic responses for league/v4/entries,
+summoner/v4, champion-mastery/v4, match/v5, champion.json and Leaguepedia wiki pages, optionally injecting
+429s (with Retry-After), 503s and latency, and runs every scenario against it.
+No API quota is spent.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --latency 0.05 --rate-429 0.02 --rate-503 0.01 --json bench.json
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from AccountIndex import AccountIndex
+from MasteryPipeline import MasteryPipeline
+from MatchStore import MatchStore
+from Metrics import metrics
+from ProFinder import LeaguepediaScraper
+from RiotAnalyzer import RiotAnalyzer
+
+
+def load_champions(path: str = None, version: str = "13.17.1") -> dict:
+    """Builds the data of a champion.json response from the champion dump in biden.csv"""
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "biden.csv")
+    data = {}
+    with open(path, encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            data[row["id"]] = {"version": version, "id": row["id"], "key": row["key"], "name": row["name"]}
+    return {"type": "champion", "format": "standAloneComplex", "version": version, "data": data}
+
+
+class MockServer:
+    """A local stand-in for the Riot API, Data Dragon and Leaguepedia
+
+    Routes:
+        /riot/{region}/lol/league/v4/entries/{queue}/{tier}/{division}?page=N
+        /riot/{region}/lol/summoner/v4/summoners/by-name/{name}
+        /riot/{region}/lol/summoner/v4/summoners/by-puuid/{puuid}
+        /riot/{region}/lol/champion-mastery/v4/champion-masteries/by-puuid/{puuid}
+        /riot/{routing}/lol/match/v5/matches/by-puuid/{puuid}/ids?start=N&count=N&startTime=N&endTime=N
+        /riot/{routing}/lol/match/v5/matches/{match_id}
+        /cdn/{version}/data/en_US/champion.json
+        /wiki/{page}
+
+    Responses in recordings (path -> JSON body, or text for wiki pages) are served as they are,
+    every other path gets a synthetic response.
+    """
+
+    def __init__(self, champions: dict, recordings: dict = None, pages: int = 20, latency: float = 0,
+                 rate_429: float = 0, rate_503: float = 0, retry_after: int = 1,
+                 app_rate_limit: str = "500:1,30000:600", seed: int = 0):
+        self.champions = champions
+        self.champion_ids = [int(c["key"]) for c in champions["data"].values()]
+        self.recordings = recordings or {}
+        self.pages = pages
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.retry_after = retry_after
+        self.app_rate_limit = app_rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.server = None
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                mock.handle(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts = {}
+
+    def total_requests(self) -> int:
+        with self.lock:
+            return sum(self.counts.values())
+
+    def __count(self, route: str):
+        with self.lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+
+    def __send(self, handler, status: int, body, content_type: str = "application/json", headers: dict = None):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def handle(self, handler):
+        parsed = urlparse(handler.path)
+        path = unquote(parsed.path)
+        query = parse_qs(parsed.query)
+        route = path.split("/")[1] if path.count("/") > 1 else path
+        if self.latency:
+            time.sleep(self.latency)
+
+        if route == "riot":
+            self.__count("riot")
+            # Faults are only injected in the rate limited API
+            with self.lock:
+                roll = self.random.random()
+            if roll < self.rate_429:
+                self.__send(handler, 429, {"status": {"status_code": 429}},
+                            headers={"Retry-After": str(self.retry_after), "X-Rate-Limit-Type": "application",
+                                     "X-App-Rate-Limit": self.app_rate_limit})
+                return
+            if roll < self.rate_429 + self.rate_503:
+                self.__send(handler, 503, {"status": {"status_code": 503}})
+                return
+            headers = {"X-App-Rate-Limit": self.app_rate_limit}
+            if path in self.recordings:
+                self.__send(handler, 200, self.recordings[path], headers=headers)
+            else:
+                status, body = self.riot(path, query)
+                self.__send(handler, status, body, headers=headers)
+        elif route == "cdn":
+            self.__count("ddragon")
+            self.__send(handler, 200, self.recordings.get(path, self.champions))
+        elif route == "wiki":
+            self.__count("wiki")
+            self.__send(handler, 200, self.recordings.get(path, self.wiki(path[len("/wiki/"):])), "text/html")
+        else:
+            self.__send(handler, 404, {"status": {"status_code": 404}})
+
+    def riot(self, path: str, query: dict):
+        """Synthetic Riot API responses, deterministic for a given path"""
+        entries = re.match(r"/riot/[^/]+/lol/league/v4/entries/([^/]+)/([^/]+)/([^/]+)$", path)
+        if entries:
+            queue, tier, division = entries.groups()
+            page = int(query.get("page", ["1"])[0])
+            if page > self.pages:
+                return 200, []
+            rng = random.Random(path + str(page))
+            return 200, [{"leagueId": "mock", "queueType": queue, "tier": tier, "rank": division,
+                          "summonerId": f"summoner-{page}-{i}", "summonerName": f"Player {page}-{i}",
+                          "leaguePoints": rng.randint(0, 100), "wins": rng.randint(10, 300),
+                          "losses": rng.randint(10, 300), "veteran": False, "inactive": False,
+                          "freshBlood": False, "hotStreak": False} for i in range(200)]
+
+        summoner = re.match(r"/riot/[^/]+/lol/summoner/v4/summoners/by-name/(.+)$", path)
+        if summoner:
+            name = summoner.group(1)
+            return 200, {"id": f"id-{name}", "accountId": f"account-{name}", "puuid": f"puuid-{name}",
+                         "name": name, "profileIconId": 1, "revisionDate": 0, "summonerLevel": 100}
+
+        by_puuid = re.match(r"/riot/[^/]+/lol/summoner/v4/summoners/by-puuid/puuid-(.+)$", path)
+        if by_puuid:
+            name = by_puuid.group(1)
+            return 200, {"id": f"id-{name}", "accountId": f"account-{name}", "puuid": f"puuid-{name}",
+                         "name": name, "profileIconId": 1, "revisionDate": 0, "summonerLevel": 100}
+
+        mastery = re.match(r"/riot/[^/]+/lol/champion-mastery/v4/champion-masteries/by-puuid/(.+)$", path)
+        if mastery:
+            puuid = mastery.group(1)
+            rng = random.Random(puuid)
+            champions = rng.sample(self.champion_ids, rng.randint(20, len(self.champion_ids)))
+            return 200, [{"puuid": puuid, "championId": c, "championLevel": rng.randint(1, 7),
+                          "championPoints": rng.randint(1000, 500000),
+                          "lastPlayTime": 1690000000000 + rng.randint(0, 10**10)} for c in champions]
+
+        match_ids = re.match(r"/riot/[^/]+/lol/match/v5/matches/by-puuid/(.+)/ids$", path)
+        if match_ids:
+            # Players numbered 0-4, 5-9, ... play the same 50 games together, an hour apart, newest first
+            number = re.search(r"(\d+)$", match_ids.group(1))
+            group = int(number.group(1)) // 5 if number else 0
+            start, count = int(query.get("start", ["0"])[0]), int(query.get("count", ["20"])[0])
+            start_time = int(query.get("startTime", ["0"])[0])
+            end_time = int(query.get("endTime", [str(2 ** 62)])[0])
+            games = [i for i in reversed(range(50)) if start_time <= self.game_start(i) // 1000 <= end_time]
+            return 200, [f"NA1_{group * 1000 + i}" for i in games[start:start + count]]
+
+        match = re.match(r"/riot/[^/]+/lol/match/v5/matches/(.+)$", path)
+        if match:
+            match_id = match.group(1)
+            rng = random.Random(match_id)
+            # The group's players are the first team
+            group = int(match_id.rsplit("_", 1)[1]) // 1000
+            return 200, {"metadata": {"matchId": match_id},
+                         "info": {"platformId": "NA1", "queueId": 420,
+                                  "gameStartTimestamp": self.game_start(int(match_id.rsplit("_", 1)[1]) % 1000),
+                                  "gameDuration": rng.randint(900, 2400), "gameVersion": "13.17.1",
+                                  "participants": [{"puuid": f"puuid-Pro{group * 5 + i}" if i < 5 else f"participant-{match_id}-{i}",
+                                                    "championId": rng.choice(self.champion_ids),
+                                                    "teamId": 100 if i < 5 else 200,
+                                                    "teamPosition": ["TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY"][i % 5],
+                                                    "win": i < 5, "kills": rng.randint(0, 15), "deaths": rng.randint(0, 15),
+                                                    "assists": rng.randint(0, 20), "totalMinionsKilled": rng.randint(0, 300),
+                                                    "neutralMinionsKilled": rng.randint(0, 100),
+                                                    "goldEarned": rng.randint(5000, 20000)} for i in range(10)]}}
+
+        return 404, {"status": {"status_code": 404}}
+
+    @staticmethod
+    def game_start(game: int) -> int:
+        """The start of the game-th game of a group of players, in epoch milliseconds"""
+        return 1690000000000 + game * 3600 * 1000
+
+    def wiki(self, page: str) -> str:
+        """A synthetic Leaguepedia player page with a Soloqueue IDs infobox"""
+        return ("<html><body><h1>{page}</h1><div id=\"mw-content-text\"><table class=\"infobox\"><tr><td class=\"infobox-label\">Role</td>"
+                "<td>Mid</td></tr><tr><td class=\"infobox-label\">Soloqueue IDs</td><td><b>NA</b> {page} NA, "
+                "{page} alt<br/><b>KR</b> {page} KR</td></tr></table>{filler}</div></body></html>"
+                ).format(page=page, filler="<p>" + "lorem ipsum " * 2000 + "</p>")
+
+
+def summarize(name: str, latencies: list, requests: int, wall: float) -> dict:
+    latencies = np.array(latencies) * 1000
+    return {"scenario": name, "operations": len(latencies), "requests": requests,
+            "requests/sec": requests / wall if wall else 0.0,
+            "p50 ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "p99 ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            "wall s": wall}
+
+
+def timed(fn):
+    """Wraps fn to record the latency of every call in fn.latencies"""
+    latencies = []
+    lock = threading.Lock()
+
+    def wrapper(*args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    wrapper.latencies = latencies
+    return wrapper
+
+
+def make_analyzer(mock: MockServer, cache_path: str, tokens: int, version: str) -> RiotAnalyzer:
+    class MockRiotAnalyzer(RiotAnalyzer):
+        ddragon_url_template = mock.url + "/cdn/{version}/data/en_US/champion.json"
+        # Skip the bundled champion snapshots, so champion.json is fetched from the mock
+        bundled_snapshot_dir = None
+
+    analyzer = MockRiotAnalyzer([f"token-{i}" for i in range(tokens)], version=version, cache_path=cache_path,
+                                snapshot_dir=os.path.join(os.path.dirname(cache_path), "champion_data"))
+    analyzer.url_template = mock.url + "/riot/{region_code}/lol/{endpoint}?{query}"
+    return analyzer
+
+
+def run_scenario(name: str, mock: MockServer, fn) -> dict:
+    mock.reset_counts()
+    start = time.perf_counter()
+    latencies = fn()
+    wall = time.perf_counter() - start
+    return summarize(name, latencies, mock.total_requests(), wall)
+
+
+def run_benchmarks(mock: MockServer, accounts: int = 200, pros: int = 100, players: int = 50,
+                   tokens: int = 1, version: str = "13.17.1") -> list:
+    """Runs every scenario against the mock server and returns one summary per scenario"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # A fresh cache per scenario, so every scenario hits the server
+        def analyzer(scenario):
+            return make_analyzer(mock, os.path.join(tmp, f"{scenario}.sqlite"), tokens, version)
+
+        def get_top():
+            ra = analyzer("get_top")
+            call = timed(lambda: ra.get_top("solo", "e4", n=20))
+            call()
+            return call.latencies
+        results.append(run_scenario("get_top", mock, get_top))
+
+        def mastery_by_name():
+            ra = analyzer("mastery")
+            call = timed(ra.get_mastery_by_summoner_name)
+            ra.map(call, [f"Player{i}" for i in range(accounts)], ["NA"] * accounts)
+            return call.latencies
+        results.append(run_scenario("get_mastery_by_summoner_name", mock, mastery_by_name))
+
+        def roster_pipeline():
+            ra = analyzer("pipeline")
+            roster = pd.DataFrame({
+                "Region": ["NA"] * pros,
+                "Official Summoner Name": [f"Pro{i}" for i in range(pros)],
+                "ids": [{"KR:": [f"Pro{i} KR"]} for i in range(pros)],
+            })
+            pipeline = MasteryPipeline(ra, os.path.join(tmp, "checkpoint.jsonl"))
+            pipeline.fetch_account = timed(pipeline.fetch_account)
+            pipeline.run(roster, verbose=False)
+            return pipeline.fetch_account.latencies
+        results.append(run_scenario("roster_pipeline", mock, roster_pipeline))
+
+        def roster_pipeline_indexed():
+            ra = analyzer("pipeline_indexed")
+            # Every pro is listed twice, the second time with another spelling of the same name
+            roster = pd.DataFrame({
+                "Region": ["NA"] * pros,
+                "Official Summoner Name": [f"Pro{i}" for i in range(pros)],
+                "ids": [{"KR:": [f"Pro{i} KR"], "NA1:": [f"pro{i}"]} for i in range(pros)],
+            })
+            index = AccountIndex(ra, os.path.join(tmp, "accounts.sqlite"))
+            pipeline = MasteryPipeline(ra, os.path.join(tmp, "checkpoint_indexed.jsonl"), index)
+            pipeline.fetch_puuid = timed(pipeline.fetch_puuid)
+            pipeline.run(roster, verbose=False)
+            index.close()
+            return pipeline.fetch_puuid.latencies
+        results.append(run_scenario("roster_pipeline_indexed", mock, roster_pipeline_indexed))
+
+        def ingest_matches():
+            ra = analyzer("matches")
+            store = MatchStore(os.path.join(tmp, "matches.sqlite"))
+            accounts = {f"puuid-Pro{i}": "NA" for i in range(pros)}
+            call = timed(ra.ingest_matches)
+            # The second sync only pages the games played since the first one
+            call(accounts, store)
+            call(accounts, store)
+            store.close()
+            return call.latencies
+        results.append(run_scenario("ingest_matches", mock, ingest_matches))
+
+        def soloq_ids():
+            scraper = LeaguepediaScraper()
+            scraper.url_template = mock.url + "/wiki/{page}"
+            call = timed(scraper.get_pro_soloq_ids)
+            for i in range(players):
+                call(f"Player{i}", "First", "Family")
+            return call.latencies
+        results.append(run_scenario("get_pro_soloq_ids", mock, soloq_ids))
+
+        def soloq_ids_many():
+            scraper = LeaguepediaScraper()
+            scraper.url_template = mock.url + "/wiki/{page}"
+            start = time.perf_counter()
+            scraper.get_pro_soloq_ids_many([(f"Many{i}", "First", "Family") for i in range(players)])
+            return [time.perf_counter() - start]
+        results.append(run_scenario("get_pro_soloq_ids_many", mock, soloq_ids_many))
+    return results
+
+
+def print_results(results: list):
+    columns = ["scenario", "operations", "requests", "requests/sec", "p50 ms", "p99 ms", "wall s"]
+    print(pd.DataFrame(results, columns=columns).to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks against local mock Riot, Data Dragon and Leaguepedia servers")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds of latency added to every response")
+    parser.add_argument("--rate-429", type=float, default=0, help="Share of Riot API responses that are 429s")
+    parser.add_argument("--rate-503", type=float, default=0, help="Share of Riot API responses that are 503s")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of the injected 429s, in seconds")
+    parser.add_argument("--app-rate-limit", default="500:1,30000:600", help="X-App-Rate-Limit sent by the mock Riot API")
+    parser.add_argument("--pages", type=int, default=20, help="Number of leaderboard pages")
+    parser.add_argument("--accounts", type=int, default=200, help="Accounts looked up by name")
+    parser.add_argument("--pros", type=int, default=100, help="Pros in the roster pipeline (2 accounts each)")
+    parser.add_argument("--players", type=int, default=50, help="Players looked up on Leaguepedia")
+    parser.add_argument("--tokens", type=int, default=1, help="Number of API tokens")
+    parser.add_argument("--recordings", help="JSON file of recorded responses, {path: body}")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--prometheus", help="Also write the collected metrics to this file, in the Prometheus text format")
+    args = parser.parse_args()
+
+    recordings = None
+    if args.recordings:
+        with open(args.recordings, encoding="utf-8") as f:
+            recordings = json.load(f)
+    mock = MockServer(load_champions(), recordings, pages=args.pages, latency=args.latency,
+                      rate_429=args.rate_429, rate_503=args.rate_503, retry_after=args.retry_after,
+                      app_rate_limit=args.app_rate_limit).start()
+    try:
+        results = run_benchmarks(mock, args.accounts, args.pros, args.players, args.tokens)
+    finally:
+        mock.stop()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.prometheus:
+        with open(args.prometheus, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus())
@@ -1,3 +1,6 @@
+import weakref
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
 
@@ -8,7 +11,125 @@ def _filter_period(series:pd.Series, period:list=[-1,9999999]):
         return series.between(period[0], period[1])
     return series.isin(period)
 
-def filter_df_in_period(df:pd.DataFrame, filter_dict:dict, return_filter:bool=False) -> pd.DataFrame or np.ndarray:
+# Masks computed with cache=True, keyed by (id(df), len(df), filter key).
+# Entries are dropped when their dataframe is garbage collected
+_mask_cache = {}
+_tracked_frames = set()
+
+
+def _forget_frame(frame_id:int):
+    _tracked_frames.discard(frame_id)
+    for key in [key for key in _mask_cache if key[0] == frame_id]:
+        del _mask_cache[key]
+
+
+def clear_filter_cache():
+    """Clears every cached mask. Call it after modifying in place a dataframe that was filtered with cache=True."""
+    _mask_cache.clear()
+
+
+class CompiledFilter:
+    """A filter_dict compiled once into a single fused mask evaluation.
+
+    Numerical ranges on the columns listed in sorted_columns (e.g. dates or points the dataframe is sorted by) are
+    found with two binary searches instead of comparing the whole column, and list filters on categorical columns
+    are looked up by category code.
+    Masks can be cached per dataframe with cache=True, so applying the same filter to the same dataframe again
+    costs nothing. NOTE: The cache assumes the dataframe isn't modified in place, use clear_filter_cache if it is.
+    """
+
+    def __init__(self, filter_dict:dict, sorted_columns:list=None):
+        """
+        Args:
+            filter_dict (dict): The filter, see filter_df_in_period
+            sorted_columns (list, optional): Columns the caller guarantees are sorted in increasing order
+                without missing values. Checking it on every call would cost as much as comparing the column.
+                Defaults to None.
+        """
+        self.sorted_columns = frozenset(sorted_columns or ())
+        self.filters = []
+        for k, v in filter_dict.items():
+            period = list(v[0])
+            inverse = bool(v[1]) if len(v) > 1 else False
+            self.filters.append((k, period, inverse))
+        self.key = (tuple((k, tuple(period), inverse) for k, period, inverse in self.filters),
+                    tuple(sorted(self.sorted_columns, key=str)))
+
+    def _column_mask(self, series:pd.Series, period:list, is_sorted:bool=False) -> np.ndarray:
+        if type(period[0]) != str:
+            # Range lookup on sorted columns: the matching rows are one contiguous slice
+            if is_sorted:
+                start = series.searchsorted(period[0], side="left")
+                stop = series.searchsorted(period[1], side="right")
+                mask = np.zeros(len(series), dtype=bool)
+                mask[start:max(start, stop)] = True
+                return mask
+            return series.between(period[0], period[1]).to_numpy(dtype=bool, na_value=False)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Look the codes up in a table of the wanted categories, the last entry is for missing values (code -1)
+            categories = series.cat.categories
+            table = np.zeros(len(categories) + 1, dtype=bool)
+            indexer = categories.get_indexer(period)
+            table[indexer[indexer >= 0]] = True
+            return table[series.cat.codes.to_numpy()]
+        return series.isin(period).to_numpy(dtype=bool)
+
+    def mask(self, df:pd.DataFrame, cache:bool=False) -> np.ndarray:
+        """Returns the boolean mask of the rows of df that pass every filter
+
+        Args:
+            df (pd.DataFrame): The dataframe to filter
+            cache (bool, optional): Reuses the mask computed for the same dataframe and filter before.
+                Only use it for dataframes that aren't modified in place. Defaults to False.
+        """
+        cache_key = (id(df), len(df), self.key)
+        if cache and cache_key in _mask_cache:
+            return _mask_cache[cache_key]
+
+        mask = np.ones(len(df), dtype=bool)
+        for k, period, inverse in self.filters:
+            column_mask = self._column_mask(df[k], period, k in self.sorted_columns)
+            if inverse:
+                column_mask = ~column_mask
+            mask &= column_mask
+
+        if not cache:
+            return mask
+        if id(df) not in _tracked_frames:
+            _tracked_frames.add(id(df))
+            weakref.finalize(df, _forget_frame, id(df))
+        # The mask is shared by every caller, so it must not be modified
+        mask.flags.writeable = False
+        _mask_cache[cache_key] = mask
+        return mask
+
+    def apply(self, df:pd.DataFrame, cache:bool=False) -> pd.DataFrame:
+        """Returns the rows of df that pass every filter, copying the dataframe once"""
+        return df[self.mask(df, cache)]
+
+
+# The most recently used compiled filters, by filter key
+_compiled_filters = OrderedDict()
+max_compiled_filters = 256
+
+
+def compile_filter(filter_dict:dict, sorted_columns:list=None) -> CompiledFilter:
+    """Compiles a filter_dict (see filter_df_in_period), reusing the compiled filter of an identical filter_dict"""
+    compiled = CompiledFilter(filter_dict, sorted_columns)
+    try:
+        if compiled.key in _compiled_filters:
+            _compiled_filters.move_to_end(compiled.key)
+            return _compiled_filters[compiled.key]
+        _compiled_filters[compiled.key] = compiled
+    except TypeError:
+        # Periods with unhashable values can't be shared, but the filter still works
+        return compiled
+    while len(_compiled_filters) > max_compiled_filters:
+        _compiled_filters.popitem(last=False)
+    return compiled
+
+def filter_df_in_period(df:pd.DataFrame, filter_dict:dict, return_filter:bool=False,
+                        sorted_columns:list=None) -> pd.DataFrame or np.ndarray:
     """
     Filters a pandas dataframe based on a dictionary of column names and periods. 
     The dictionary should be in the form {column_name: [[period], inverse]}. Refer to the example below.
@@ -17,6 +138,8 @@ def filter_df_in_period(df:pd.DataFrame, filter_dict:dict, return_filter:bool=Fa
     If inverse is True, the filter will be inverted. If not specified, it defaults to False (returns the normal, non-inverted filter).
     If return_filter is True, returns a boolean mask of the dataframe instead of the dataframe itself. This is useful for
     when you want to apply the same filter to multiple dataframes.
+    The filter_dict is compiled into a CompiledFilter. Masks are never cached here, use CompiledFilter.mask(df, cache=True)
+    to reuse the masks of a dataframe that isn't modified in place.
 
     
     Args:
@@ -27,6 +150,8 @@ def filter_df_in_period(df:pd.DataFrame, filter_dict:dict, return_filter:bool=Fa
                 column_name_2: [[period_2], inverse_2],
             }
         return_filter (bool, optional): Returns the mask filter if True. Defaults to False.
+        sorted_columns (list, optional): Columns known to be sorted in increasing order without missing values,
+            their ranges are found by binary search. Defaults to None.
 
     Returns:
         pd.DataFrame or np.ndarray: If return_filter is False, returns the filtered dataframe. 
@@ -43,23 +168,13 @@ def filter_df_in_period(df:pd.DataFrame, filter_dict:dict, return_filter:bool=Fa
         OR
         >>> df = filter_df_in_period(df, filter_dict)
     """
+    compiled = compile_filter(filter_dict, sorted_columns)
+    mask = compiled.mask(df)
     if not return_filter:
-        for k,v in filter_dict.items():
-            period = v[0]
-            inverse = v[1] if len(v) > 1 else False
-            if not inverse:
-                df = df[_filter_period(df[k], period)]
-            else:
-                df = df[~_filter_period(df[k], period)]
-        return df
+        # A single copy of the rows that pass every filter
+        return df[mask]
     else:
         # Returns the mask used to filter the df
-        mask = np.ones(len(df), dtype=bool)
-        for k,v in filter_dict.items():
-            period = v[0]
-            inverse = v[1] if len(v) > 1 else False
-            if not inverse:
-                mask = mask & _filter_period(df[k], period)
-            else:
-                mask = mask & ~_filter_period(df[k], period)
-        return mask
\ No newline at end of file
+        if not filter_dict:
+            return mask
+        return pd.Series(mask, index=df.index)
\ No newline at end of file
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
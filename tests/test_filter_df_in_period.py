@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from filter_df_in_period import compile_filter, filter_df_in_period
+
+
+def baseline_filter_period(series, period):
+    if type(period[0]) != str:
+        return series.between(period[0], period[1])
+    return series.isin(period)
+
+
+def baseline_filter_df_in_period(df, filter_dict, return_filter=False):
+    """filter_df_in_period before it was compiled into a single mask"""
+    if not return_filter:
+        for k, v in filter_dict.items():
+            inverse = v[1] if len(v) > 1 else False
+            mask = baseline_filter_period(df[k], v[0])
+            df = df[~mask if inverse else mask]
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for k, v in filter_dict.items():
+        inverse = v[1] if len(v) > 1 else False
+        column_mask = baseline_filter_period(df[k], v[0])
+        mask = mask & (~column_mask if inverse else column_mask)
+    return mask
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    size = 500
+    points = rng.integers(0, 1000, size).astype(float)
+    # Missing values never pass a range or a list, and always pass their inverse
+    points[rng.choice(size, 20, replace=False)] = np.nan
+    roles = rng.choice(["Top", "Jungle", "Mid", "Bot", "Sup"], size)
+    return pd.DataFrame({
+        "date": np.sort(rng.integers(0, 10000, size)),
+        "points": points,
+        "role": roles,
+        "role_category": pd.Categorical(np.where(rng.random(size) < 0.05, None, roles)),
+    }, index=rng.permutation(size) + 100)
+
+
+filters = {
+    "range": {"points": [[100, 600]]},
+    "inverse range": {"points": [[100, 600], True]},
+    "list": {"role": [["Top", "Mid"]]},
+    "inverse list": {"role": [["Top", "Mid"], True]},
+    "categorical list": {"role_category": [["Jungle", "Sup", "Missing"]]},
+    "inverse categorical list": {"role_category": [["Jungle", "Sup"], True]},
+    "sorted range": {"date": [[2000, 7000]]},
+    "empty range": {"date": [[7000, 2000]]},
+    "combined": {"date": [[1000, 9000]], "points": [[0, 800], True], "role": [["Bot", "Sup"]],
+                 "role_category": [["Bot", "Sup", "Top"], False]},
+    "no filter": {},
+}
+
+
+@pytest.mark.parametrize("name", list(filters))
+@pytest.mark.parametrize("sorted_columns", [None, ["date"]])
+def test_filter_matches_baseline(df, name, sorted_columns):
+    filter_dict = filters[name]
+    expected = baseline_filter_df_in_period(df, filter_dict)
+    result = filter_df_in_period(df, filter_dict, sorted_columns=sorted_columns)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("name", list(filters))
+@pytest.mark.parametrize("sorted_columns", [None, ["date"]])
+def test_mask_matches_baseline(df, name, sorted_columns):
+    filter_dict = filters[name]
+    expected = np.asarray(baseline_filter_df_in_period(df, filter_dict, return_filter=True), dtype=bool)
+    result = filter_df_in_period(df, filter_dict, return_filter=True, sorted_columns=sorted_columns)
+    np.testing.assert_array_equal(np.asarray(result, dtype=bool), expected)
+    # The mask can be applied to another dataframe with the same rows
+    pd.testing.assert_frame_equal(df[result], df[expected])
+
+
+def test_cached_mask(df):
+    compiled = compile_filter(filters["combined"], sorted_columns=["date"])
+    expected = np.asarray(baseline_filter_df_in_period(df, filters["combined"], return_filter=True), dtype=bool)
+    first = compiled.mask(df, cache=True)
+    np.testing.assert_array_equal(first, expected)
+    assert compiled.mask(df, cache=True) is first
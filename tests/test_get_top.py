@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from RiotAnalyzer import RiotAnalyzer
+
+
+def make_pages(page_count=3, page_size=200, seed=0):
+    rng = random.Random(seed)
+    pages = []
+    for page in range(page_count):
+        entries = []
+        for i in range(page_size):
+            wins, losses = rng.randint(0, 60), rng.randint(0, 60)
+            entries.append({
+                "summonerId": f"id-{page}-{i}",
+                "summonerName": f"player-{page}-{i}",
+                # A narrow LP range, so there are ties on leaguePoints and on winrate
+                "leaguePoints": rng.randint(0, 40),
+                "rank": "I",
+                "wins": wins,
+                "losses": losses,
+                "veteran": rng.random() < 0.1,
+            })
+        pages.append(entries)
+    return pages
+
+
+def baseline_get_top(pages, n):
+    """The get_top loop before the heap, without the printing"""
+    result_df = pd.DataFrame()
+    for data in pages:
+        df = pd.DataFrame(data)
+        df["winrate"] = df["wins"] / (df["wins"] + df["losses"])
+        result_df = pd.concat([result_df, df])
+        result_df = result_df.sort_values(by=["leaguePoints", "winrate"], ascending=False)
+        result_df = result_df.head(n)
+    result_df = result_df.reset_index(drop=True)
+    result_df.index.name = "Rank"
+    result_df.index += 1
+    return result_df
+
+
+class FixedLeaderboard(RiotAnalyzer):
+    def __init__(self, pages):
+        super().__init__("token", cache_path=None)
+        self.pages = pages
+
+    def get_leaderboard_raw(self, queue, rank, region=None, page=1):
+        return self.pages[page - 1] if page <= len(self.pages) else []
+
+
+@pytest.mark.parametrize("n", [0, 1, 20, 250, 1000])
+def test_get_top_matches_baseline(n):
+    pages = make_pages()
+    result = FixedLeaderboard(pages).get_top("solo", "challenger", n=n)
+    expected = baseline_get_top(pages, n)
+
+    assert list(result.columns) == list(expected.columns)
+    assert list(result.index) == list(expected.index)
+    assert result.index.name == expected.index.name
+    # Rows tied on leaguePoints and winrate may come in another order, so only the sort keys are compared row by row
+    assert list(result["leaguePoints"]) == list(expected["leaguePoints"])
+    np.testing.assert_array_equal(result["winrate"].to_numpy(dtype=float), expected["winrate"].to_numpy(dtype=float))
+    assert (result.dtypes == expected.dtypes).all()
+
+
+def test_get_top_empty_leaderboard():
+    result = FixedLeaderboard([]).get_top("solo", "challenger", n=20)
+    assert result.empty
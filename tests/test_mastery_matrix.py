@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from MasteryMatrix import MasteryMatrix, load_role_matrix, role_list
+from MasteryPipeline import parse_account_list
+
+
+champion_dict = {"1": "Annie", "2": "Olaf", "3": "Galio", "4": "Twisted Fate", "5": "Xin Zhao", "6": "Urgot"}
+
+role_df = pd.DataFrame({
+    "key": [1, 2, 3, 4, 5, 6],
+    "name": ["Annie", "Olaf", "Galio", "Twisted Fate", "Xin Zhao", "Urgot"],
+    "Top": [np.nan, True, True, np.nan, True, True],
+    "Jungle": [np.nan, True, np.nan, np.nan, True, np.nan],
+    "Mid": [True, np.nan, True, True, np.nan, np.nan],
+    "Bot": [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+    "Sup": [True, np.nan, True, np.nan, np.nan, np.nan],
+})
+
+roster_df = pd.DataFrame({
+    "Official Summoner Name": ["Solo", "Alts", "Stringy", "Empty"],
+    "Roles (LeaguePedia)": ["Mid", "Jungle", "Top", "Sup"],
+    # Account_list as the dictionaries, or as their strings like in pro_mastery.csv
+    "Account_list": [
+        {"NA:": ["solo"]},
+        {"KR:": ["alt one", "alt two"], "EUW:": ["alt three"]},
+        "{'BR:': ['stringy']}",
+        {"NA:": ["nobody"]},
+    ],
+}, index=[10, 11, 12, 13])
+
+mastery = {
+    ("NA", "solo"): {1: 50000, 3: 12000, 4: 800},
+    ("KR", "alt one"): {2: 90000, 5: 4000},
+    ("KR", "alt two"): {2: 10000, 6: 2500, 1: 100},
+    ("EUW", "alt three"): {5: 30000},
+    ("BR", "stringy"): {6: 400000},
+}
+
+results = {
+    (region, name): {"region": region, "name": name, "puuid": f"puuid-{region}-{name}",
+                     "mastery": [{"championId": c, "championPoints": p} for c, p in points.items()]}
+    for (region, name), points in mastery.items()
+}
+
+
+def notebook_scores(account_list, role):
+    """pro_dict_to_mastery from main.ipynb, reading the mastery from the fixture instead of the API"""
+    champ_role_dict = {}
+    for _, row in role_df.iterrows():
+        champ_role_dict[row["name"]] = [r for r in role_list if type(row[r]) != float]
+    mastery_dict = {}
+    for region, names in account_list.items():
+        for name in names:
+            for champion_id, points in mastery[(region.replace(":", ""), name)].items():
+                champ = champion_dict[str(champion_id)]
+                mastery_dict[champ] = mastery_dict.get(champ, 0) + points
+    total = sum(mastery_dict.values())
+    onetrickscore = 0
+    mainrolescore = 0
+    for champ, points in mastery_dict.items():
+        onetrickscore += (100 * points / total - (100 / len(champion_dict))) ** 2
+        if role in champ_role_dict[champ]:
+            mainrolescore += points
+    return [mainrolescore / total, onetrickscore, total]
+
+
+def test_scores_match_notebook():
+    matrix = MasteryMatrix.from_results(roster_df, results, champion_dict)
+    role_matrix = load_role_matrix(matrix.champion_ids, role_df=role_df)
+    scores = matrix.scores(roster_df["Roles (LeaguePedia)"], role_matrix)
+
+    assert list(scores.index) == list(roster_df.index)
+    for index, row in roster_df.iloc[:3].iterrows():
+        account_list = parse_account_list(row["Account_list"])
+        mainrolescore, onetrickscore, totalmastery = notebook_scores(account_list, row["Roles (LeaguePedia)"])
+        assert scores.loc[index, "mainrolescore"] == pytest.approx(mainrolescore)
+        assert scores.loc[index, "offrolescore"] == pytest.approx(1 - mainrolescore)
+        assert scores.loc[index, "onetrickscore"] == pytest.approx(onetrickscore)
+        assert scores.loc[index, "totalmastery"] == totalmastery
+
+    # A pro without mastery has no scores instead of the notebook's zeros
+    assert scores.loc[13, "totalmastery"] == 0
+    assert np.isnan(scores.loc[13, "onetrickscore"])
+
+
+def test_shared_account_counted_once():
+    # The same account listed under a region alias and by a second pro only counts for the first one
+    shared = {**results, ("NA1", "solo"): results[("NA", "solo")]}
+    roster = pd.DataFrame({"Account_list": [{"NA:": ["solo"], "NA1:": ["solo"]}, {"NA1:": ["solo"]}]})
+    matrix = MasteryMatrix.from_results(roster, shared, champion_dict)
+    assert list(matrix.total_mastery()) == [sum(mastery[("NA", "solo")].values()), 0]
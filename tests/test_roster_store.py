@@ -0,0 +1,22 @@
+import os
+
+import pandas as pd
+
+from conftest import repo_root
+from MasteryPipeline import account_keys
+from RosterStore import RosterStore, roster_tables
+
+
+def test_migrate_pro_mastery_csv(tmp_path):
+    # The Account_list column of the CSV holds the dictionaries as strings
+    roster_df = pd.read_csv(os.path.join(repo_root, "pro_mastery.csv"), index_col=0, nrows=20)
+    pros, accounts = roster_tables(roster_df)
+    store = RosterStore(str(tmp_path))
+    store.save_pros(pros)
+    store.save_accounts(accounts)
+
+    roster = store.load_roster()
+    assert list(roster["Official Summoner Name"]) == list(roster_df["Official Summoner Name"])
+    assert list(roster["Team"]) == list(roster_df["Team"])
+    for loaded, original in zip(roster["Account_list"], roster_df["Account_list"]):
+        assert sorted(account_keys(loaded)) == sorted(account_keys(original))